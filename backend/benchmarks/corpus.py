@@ -0,0 +1,73 @@
+import random
+from pathlib import Path
+from typing import Union
+
+# Vocabulary for the synthetic sourcebooks
+MONSTERS = ("Beholder", "Mind Flayer", "Lich", "Owlbear", "Displacer Beast", "Gelatinous Cube",
+            "Red Dragon", "Basilisk", "Hobgoblin", "Kobold", "Wraith", "Troll", "Chimera", "Medusa")
+SPELLS = ("Fireball", "Magic Missile", "Counterspell", "Cure Wounds", "Misty Step", "Banishment",
+          "Hold Person", "Shield", "Wall of Force", "Eldritch Blast", "Polymorph", "Revivify")
+PLACES = ("Waterdeep", "Neverwinter", "the Underdark", "Baldur's Gate", "Candlekeep", "Icewind Dale",
+          "the Feywild", "Phandalin", "the Sword Coast", "Barovia")
+FILLER = ("the", "party", "must", "travel", "through", "ancient", "ruins", "where", "a", "creature",
+          "guards", "treasure", "and", "each", "round", "it", "may", "attack", "twice", "with", "its",
+          "claws", "dealing", "damage", "on", "a", "failed", "saving", "throw", "against", "magic",
+          "while", "allies", "hold", "the", "line", "until", "dawn", "breaks", "over", "hills")
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(FILLER) for _ in range(rng.randint(8, 20))]
+    # Sprinkle named entities so exact-name (lexical) lookups have something to find
+    if rng.random() < 0.5:
+        words.insert(rng.randrange(len(words)), rng.choice(MONSTERS + SPELLS + PLACES))
+    return " ".join(words).capitalize() + "."
+
+
+def generate_corpus(directory: Union[str, Path], books: int = 4, pages_per_book: int = 40,
+                    paragraphs_per_page: int = 6, seed: int = 7) -> list:
+    """
+    Write a reproducible synthetic sourcebook library as text files.
+
+    Each book has chapters with headings and paragraphs that mention monsters,
+    spells and places, so chunking, section tracking and both kinds of retrieval
+    are exercised. Pages are separated by blank lines like paragraphs.
+
+    Returns:
+        list: The paths of the generated books.
+    """
+    rng = random.Random(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for book in range(books):
+        sections = []
+        for page in range(pages_per_book):
+            if page % 5 == 0:
+                sections.append(f"CHAPTER {page // 5 + 1}")
+                sections.append(f"{rng.choice(MONSTERS)} of {rng.choice(PLACES)}")
+            for _ in range(paragraphs_per_page):
+                sections.append(" ".join(_sentence(rng) for _ in range(rng.randint(3, 7))))
+        path = directory / f"synthetic_book_{book + 1:02d}.txt"
+        path.write_text("\n\n".join(sections), encoding="utf-8")
+        paths.append(path)
+    return paths
+
+
+def generate_queries(count: int, seed: int = 11) -> list:
+    """
+    Return a reproducible mix of natural-language and exact-name queries.
+    """
+    rng = random.Random(seed)
+    templates = (
+        "how does {spell} work",
+        "{monster} lair in {place}",
+        "what can a {monster} do each round",
+        "{spell}",
+        "{monster}",
+        "encounter near {place} with a {monster}",
+    )
+    return [
+        rng.choice(templates).format(spell=rng.choice(SPELLS), monster=rng.choice(MONSTERS),
+                                     place=rng.choice(PLACES)) + (f" {index}" if index >= 60 else "")
+        for index in range(count)
+    ]
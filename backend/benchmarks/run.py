@@ -0,0 +1,469 @@
+"""
+Offline benchmark and load test.
+
+Runs entirely on this machine: a generated sourcebook corpus, a throwaway vector
+store, a local SQLite database (or DATABASE_URL) and a stub Ollama server with a
+configurable token rate. Measures ingestion throughput, retrieval latency per
+mode, and time-to-first-token and end-to-end narration latency under concurrent
+players, then writes the results as JSON. With --baseline the run fails if any
+metric regressed by more than --tolerance.
+
+    python backend/benchmarks/run.py --players 8 --output bench_results/latest.json
+    python backend/benchmarks/run.py --baseline bench_results/main.json
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import hashlib
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_ROOT = BENCH_DIR.parent.parent
+sys.path[:0] = [str(REPO_ROOT), str(BENCH_DIR)]
+
+# Metrics compared against a baseline, and whether higher values are better
+TRACKED_METRICS = {
+    "ingest.chunks_per_second": True,
+    "ingest.megabytes_per_second": True,
+    "retrieval.vector.p50_ms": False,
+    "retrieval.vector.p99_ms": False,
+    "retrieval.hybrid.p50_ms": False,
+    "retrieval.hybrid.p99_ms": False,
+    "retrieval.lexical.p50_ms": False,
+    "retrieval.lexical.p99_ms": False,
+    "narration.ttft_ms.p50": False,
+    "narration.ttft_ms.p99": False,
+    "narration.total_ms.p50": False,
+    "narration.total_ms.p99": False,
+    "narration.requests_per_second": True,
+}
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite.")
+    parser.add_argument("--books", type=int, default=4, help="Synthetic sourcebooks to generate")
+    parser.add_argument("--pages", type=int, default=40, help="Pages per synthetic sourcebook")
+    parser.add_argument("--processes", type=int, default=None, help="Ingestion worker processes")
+    parser.add_argument("--queries", type=int, default=100, help="Retrieval queries per mode")
+    parser.add_argument("--players", type=int, default=8, help="Concurrent simulated players")
+    parser.add_argument("--rounds", type=int, default=3, help="Narration requests per player")
+    parser.add_argument("--seed-logs", type=int, default=200, help="Narration logs written before the load test")
+    parser.add_argument("--ttft", type=float, default=0.15, help="Stub Ollama seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=40.0, help="Stub Ollama decode rate")
+    parser.add_argument("--reply-tokens", type=int, default=48, help="Tokens in each stub reply")
+    parser.add_argument("--embedder", choices=("default", "hash"), default="default",
+                        help="'default' uses the real embedding model; 'hash' is a fast stand-in "
+                             "for machines without the model (latencies are then not comparable)")
+    parser.add_argument("--skip", action="append", default=[], choices=("ingest", "retrieval", "narration"),
+                        help="Stage to skip; may be repeated")
+    parser.add_argument("--work-dir", default=None, help="Keep the corpus and stores here (default: temporary)")
+    parser.add_argument("--output", default=str(REPO_ROOT / "bench_results" / "latest.json"),
+                        help="Where to write the results")
+    parser.add_argument("--baseline", default=None, help="Previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative regression against the baseline (0.2 = 20%%)")
+    return parser.parse_args(argv)
+
+
+def configure_environment(work_dir: Path, ollama_url: str):
+    """
+    Point every store at the work directory and Ollama at the stub. Must run
+    before any backend module is imported, since they read settings on import.
+    """
+    os.environ["CHROMA_DIR"] = str(work_dir / "chroma")
+    os.environ["MANIFEST_DIR"] = str(work_dir / "chroma" / "manifests")
+    os.environ["LEXICAL_DIR"] = str(work_dir / "chroma" / "lexical")
+    os.environ["EMBEDDING_CACHE_DIR"] = str(work_dir / "chroma" / "embeddings")
+    os.environ["OLLAMA_URL"] = ollama_url
+    os.environ.pop("OLLAMA_BACKENDS", None)
+    os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{work_dir / 'bench.db'}")
+
+
+def install_hash_embedder():
+    """
+    Replace the embedding model with a bag-of-words hashing embedder.
+    """
+    from backend import embeddings
+
+    def embed(texts):
+        vectors = np.zeros((len(texts), 384), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, int(hashlib.md5(word.encode()).hexdigest()[:8], 16) % 384] += 1.0
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+        return list(vectors)
+
+    embeddings._embedding_function = embed
+
+
+async def prepare_database():
+    """
+    Create the schema. SQLite lacks tsvector, so there the search column is
+    stored as text and to_tsvector is registered as a plain function.
+    """
+    from sqlalchemy import event
+    from backend.database import engine
+    from backend.models import Base
+
+    if engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.postgresql import TSVECTOR
+        from sqlalchemy.ext.compiler import compiles
+
+        @compiles(TSVECTOR, "sqlite")
+        def _tsvector_as_text(type_, compiler, **kw):
+            return "TEXT"
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def _register_functions(dbapi_connection, connection_record):
+            dbapi_connection.create_function("to_tsvector", 2, lambda config, text: text.lower(),
+                                             deterministic=True)
+
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app, port: int):
+    """
+    Serve an ASGI app on a background thread and wait until it accepts requests.
+    """
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 30
+    while not server.started:
+        if time.monotonic() > deadline or not thread.is_alive():
+            raise RuntimeError(f"Server on port {port} did not start")
+        time.sleep(0.05)
+    return server, thread
+
+
+def latency_summary(samples: list) -> dict:
+    """
+    Summarize latencies in seconds as milliseconds.
+    """
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples) * 1000
+    return {
+        "count": len(samples),
+        "mean": round(float(values.mean()), 2),
+        "p50": round(float(np.percentile(values, 50)), 2),
+        "p95": round(float(np.percentile(values, 95)), 2),
+        "p99": round(float(np.percentile(values, 99)), 2),
+        "max": round(float(values.max()), 2),
+    }
+
+
+def bench_ingest(work_dir: Path, args) -> dict:
+    from corpus import generate_corpus
+    from backend.ingest import ingest_directory, BULK_INGEST_PROCESSES
+
+    corpus_dir = work_dir / "corpus"
+    generate_corpus(corpus_dir, books=args.books, pages_per_book=args.pages)
+    report = ingest_directory(corpus_dir, processes=args.processes or BULK_INGEST_PROCESSES)
+    if "error" in report:
+        raise RuntimeError(report["error"])
+    totals = report["totals"]
+    if totals["failed"]:
+        raise RuntimeError(f"{totals['failed']} corpus files failed to ingest")
+    return {
+        "files": totals["indexed"],
+        "chunks": totals["chunks"],
+        "megabytes": round(sum(result.get("bytes", 0) for result in report["files"]) / (1024 * 1024), 2),
+        "elapsed_seconds": totals["elapsed_seconds"],
+        "chunks_per_second": totals["chunks_per_second"],
+        "megabytes_per_second": totals["megabytes_per_second"],
+    }
+
+
+def bench_retrieval(args) -> dict:
+    """
+    Time uncached retrieval per mode. The retrieval cache is cleared before every
+    query so each one reaches the vector store and BM25 index.
+    """
+    from corpus import generate_queries
+    from backend.utils import retrieve_from_chromadb, retrieval_cache, RETRIEVAL_MODES
+
+    queries = generate_queries(args.queries)
+    # One untimed query per mode loads the model and indexes
+    for mode in RETRIEVAL_MODES:
+        retrieve_from_chromadb(queries[0], mode=mode)
+
+    results = {}
+    for mode in RETRIEVAL_MODES:
+        samples = []
+        for query in queries:
+            retrieval_cache.clear()
+            started = time.perf_counter()
+            retrieve_from_chromadb(query, n_results=5, mode=mode)
+            samples.append(time.perf_counter() - started)
+        summary = latency_summary(samples)
+        results[mode] = {f"{key}_ms" if key != "count" else key: value for key, value in summary.items()}
+    return results
+
+
+async def _simulate_player(client, campaign_id: int, player: int, rounds: int, samples: list):
+    for round_number in range(rounds):
+        # Distinct prompts so the scheduler cannot coalesce players into one generation
+        prompt = f"Player {player} searches the crypt for the Lich's phylactery (turn {round_number})"
+        started = time.perf_counter()
+        first_token = None
+        error = None
+        try:
+            async with client.stream("POST", f"/campaigns/{campaign_id}/narrate",
+                                     json={"prompt": prompt}) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    message = json.loads(line)
+                    if "content" in message and first_token is None:
+                        first_token = time.perf_counter() - started
+                    elif "error" in message:
+                        error = message["error"]
+        except Exception as e:
+            error = str(e)
+        samples.append({"ttft": first_token, "total": time.perf_counter() - started, "error": error})
+
+
+async def seed_campaign(seed_logs: int) -> int:
+    """
+    Create the benchmark campaign and its narration history directly in the database.
+
+    Posting the history through the API would queue a rolling-summary LLM call per
+    log, and those calls would compete with the players being measured.
+
+    Returns:
+        int: The campaign id.
+    """
+    from corpus import generate_queries
+    from backend.database import async_session_maker, engine
+    from backend.models import Campaign, NarrationLog
+
+    async with async_session_maker() as db:
+        campaign = Campaign(name="Benchmark Campaign")
+        db.add(campaign)
+        await db.flush()
+        db.add_all([
+            NarrationLog(campaign_id=campaign.id, content=f"Turn {index}: the party dealt with {text}.")
+            for index, text in enumerate(generate_queries(seed_logs, seed=3))
+        ])
+        await db.commit()
+        campaign_id = campaign.id
+    # The server runs on another event loop; don't hand it this loop's connections
+    await engine.dispose()
+    return campaign_id
+
+
+async def check_history_pages(client, campaign_id: int, expected: int, page_size: int = 50):
+    """
+    Page through a campaign's narration history and check that pages never overlap
+    and together return every log exactly once.
+
+    The seeded logs share one timestamp, so this exercises the cursor's tie-break on id.
+
+    Raises:
+        RuntimeError: If a page repeats a log or logs are missing.
+    """
+    seen, cursor = set(), None
+    for _ in range(expected // page_size + 2):
+        params = {"limit": page_size, **({"cursor": cursor} if cursor else {})}
+        page = (await client.get(f"/campaigns/{campaign_id}/narration_logs/", params=params)).json()
+        ids = {item["id"] for item in page["items"]}
+        if ids & seen:
+            raise RuntimeError(f"History pages overlap on ids {sorted(ids & seen)}")
+        seen |= ids
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    if len(seen) != expected or cursor is not None:
+        raise RuntimeError(f"Paging returned {len(seen)} of {expected} logs")
+
+
+async def _narration_load(api_url: str, campaign_id: int, args) -> dict:
+    import httpx
+
+    timeout = httpx.Timeout(120.0)
+    limits = httpx.Limits(max_connections=args.players + 4)
+    async with httpx.AsyncClient(base_url=api_url, timeout=timeout, limits=limits) as client:
+        # Wait for the vector store warm start
+        deadline = time.monotonic() + 120
+        while (await client.get("/ready")).status_code != 200:
+            if time.monotonic() > deadline:
+                raise RuntimeError("API did not become ready")
+            await asyncio.sleep(0.1)
+
+        await check_history_pages(client, campaign_id, args.seed_logs)
+
+        samples = []
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            _simulate_player(client, campaign_id, player, args.rounds, samples)
+            for player in range(args.players)
+        ))
+        elapsed = time.perf_counter() - started
+
+    completed = [sample for sample in samples if not sample["error"] and sample["ttft"] is not None]
+    return {
+        "players": args.players,
+        "requests": len(samples),
+        "errors": len(samples) - len(completed),
+        "elapsed_seconds": round(elapsed, 3),
+        "requests_per_second": round(len(completed) / elapsed, 2) if elapsed else 0.0,
+        "ttft_ms": latency_summary([sample["ttft"] for sample in completed]),
+        "total_ms": latency_summary([sample["total"] for sample in completed]),
+        "first_error": next((sample["error"] for sample in samples if sample["error"]), None),
+    }
+
+
+def bench_narration(stub_app, args) -> dict:
+    from backend.main import create_app
+    from backend.ollama_client import OLLAMA_MAX_CONCURRENCY
+
+    campaign_id = asyncio.run(seed_campaign(args.seed_logs))
+    api_port = free_port()
+    server, thread = start_server(create_app(), api_port)
+    try:
+        results = asyncio.run(_narration_load(f"http://127.0.0.1:{api_port}", campaign_id, args))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+    results["ollama_max_concurrency"] = OLLAMA_MAX_CONCURRENCY
+    results["stub"] = dict(stub_app.state.stats)
+    return results
+
+
+def metric(results: dict, path: str):
+    value = results
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value if isinstance(value, (int, float)) else None
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Find the tracked metrics that got worse than the baseline by more than the tolerance.
+
+    Returns:
+        list: One dict per regression with the metric, baseline and current values.
+    """
+    regressions = []
+    for path, higher_is_better in TRACKED_METRICS.items():
+        current, previous = metric(results, path), metric(baseline, path)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append({"metric": path, "baseline": previous, "current": current,
+                                "change": round(change, 3)})
+    return regressions
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: list = None) -> int:
+    args = parse_args(argv)
+    temporary = None
+    if args.work_dir:
+        work_dir = Path(args.work_dir).resolve()
+        work_dir.mkdir(parents=True, exist_ok=True)
+    else:
+        temporary = tempfile.TemporaryDirectory(prefix="bench-")
+        work_dir = Path(temporary.name)
+
+    stub_port = free_port()
+    configure_environment(work_dir, f"http://127.0.0.1:{stub_port}")
+    if args.embedder == "hash":
+        install_hash_embedder()
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "database": os.environ["DATABASE_URL"].split(":", 1)[0],
+            "settings": {key: value for key, value in vars(args).items()
+                         if key not in ("output", "baseline", "work_dir")},
+        }
+    }
+    try:
+        if "ingest" not in args.skip:
+            print("Ingesting synthetic corpus...")
+            results["ingest"] = bench_ingest(work_dir, args)
+            print(f"  {results['ingest']}")
+        if "retrieval" not in args.skip:
+            print("Timing retrieval...")
+            results["retrieval"] = bench_retrieval(args)
+            for mode, summary in results["retrieval"].items():
+                print(f"  {mode}: {summary}")
+        if "narration" not in args.skip:
+            from stub_ollama import create_stub_app
+            print(f"Load testing narration with {args.players} players...")
+            asyncio.run(prepare_database())
+            stub_app = create_stub_app(args.ttft, args.tokens_per_second, args.reply_tokens)
+            stub_server, stub_thread = start_server(stub_app, stub_port)
+            try:
+                results["narration"] = bench_narration(stub_app, args)
+            finally:
+                stub_server.should_exit = True
+                stub_thread.join(timeout=30)
+            narration = results["narration"]
+            print(f"  {narration['requests']} requests, {narration['errors']} errors, "
+                  f"ttft {narration['ttft_ms']}, total {narration['total_ms']}")
+    finally:
+        if temporary is not None:
+            temporary.cleanup()
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"Results written to {output}")
+
+    status = 1 if results.get("narration", {}).get("errors") else 0
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        if baseline.get("meta", {}).get("settings") != results["meta"]["settings"]:
+            print("Warning: the baseline was run with different settings")
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['metric']}: {regression['baseline']} -> {regression['current']} "
+                  f"({regression['change']:+.0%})")
+        if regressions:
+            status = 1
+        else:
+            print(f"No regressions beyond {args.tolerance:.0%} of {args.baseline}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime, timezone
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+# Words the stub "generates"
+STUB_WORDS = ("The", "torchlight", "flickers", "as", "the", "party", "descends", "into", "the",
+              "ruined", "crypt,", "where", "something", "old", "and", "patient", "waits.")
+
+
+def create_stub_app(ttft: float = 0.15, tokens_per_second: float = 40.0, reply_tokens: int = 48,
+                    prefill_tokens_per_second: float = 2000.0, model: str = "llama3.2") -> FastAPI:
+    """
+    Build a stand-in for an Ollama server that streams /api/chat replies at a fixed rate.
+
+    The time to the first token is ttft plus the prompt's estimated tokens divided
+    by prefill_tokens_per_second, so longer prompts cost more, as on a real GPU.
+
+    Args:
+        ttft (float): Fixed seconds before the first token.
+        tokens_per_second (float): Decode rate after the first token.
+        reply_tokens (int): Tokens in every reply.
+        prefill_tokens_per_second (float): Prompt processing rate.
+        model (str): Model name reported by /api/tags.
+    """
+    app = FastAPI()
+    app.state.stats = {"requests": 0, "in_flight": 0, "max_in_flight": 0, "prompt_tokens": 0}
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": f"{model}:latest"}]}
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.stats
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        body = await request.json()
+        prompt_tokens = sum(len(message.get("content", "")) for message in body.get("messages", [])) // 4
+        stats = app.state.stats
+        stats["requests"] += 1
+        stats["prompt_tokens"] += prompt_tokens
+
+        async def generate():
+            stats["in_flight"] += 1
+            stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+            started = time.perf_counter()
+            try:
+                await asyncio.sleep(ttft + prompt_tokens / prefill_tokens_per_second)
+                for index in range(reply_tokens):
+                    chunk = {
+                        "model": body.get("model", model),
+                        "created_at": datetime.now(timezone.utc).isoformat(),
+                        "message": {"role": "assistant", "content": STUB_WORDS[index % len(STUB_WORDS)] + " "},
+                        "done": False,
+                    }
+                    yield json.dumps(chunk) + "\n"
+                    await asyncio.sleep(1.0 / tokens_per_second)
+                yield json.dumps({
+                    "model": body.get("model", model),
+                    "done": True,
+                    "prompt_eval_count": prompt_tokens,
+                    "eval_count": reply_tokens,
+                    "total_duration": int((time.perf_counter() - started) * 1e9),
+                }) + "\n"
+            finally:
+                stats["in_flight"] -= 1
+
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a stub Ollama server for benchmarks.")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--ttft", type=float, default=0.15)
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--reply-tokens", type=int, default=48)
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=2000.0)
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(create_stub_app(args.ttft, args.tokens_per_second, args.reply_tokens,
+                                args.prefill_tokens_per_second),
+                host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import os
+import asyncio
+from typing import AsyncIterator, Optional
+
+# Events buffered per subscriber before it is considered too slow and dropped
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("SUBSCRIBER_QUEUE_SIZE", "256"))
+
+
+class SubscriberOverflowError(Exception):
+    """
+    Raised to a subscriber that fell so far behind that events were dropped; it
+    should reconnect and resume from the last id it received.
+    """
+
+
+def narration_event(log) -> dict:
+    """
+    Serialize a NarrationLog for delivery to players.
+    """
+    return {
+        "id": log.id,
+        "campaign_id": log.campaign_id,
+        "content": log.content,
+        "recipients": log.recipients,
+        "created_at": log.created_at.isoformat() if log.created_at else None,
+    }
+
+
+class Subscription:
+    """
+    One connected player's view of a campaign's narration feed.
+    """
+
+    def __init__(self, campaign_id: int, player: Optional[str], maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        self.campaign_id = campaign_id
+        self.player = player
+        self.overflowed = False
+        self._queue = asyncio.Queue(maxsize)
+
+    def wants(self, event: dict) -> bool:
+        # Narration without recipients goes to every player
+        recipients = event.get("recipients")
+        return not recipients or self.player in recipients
+
+    def offer(self, event: dict) -> bool:
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.overflowed = True
+            return False
+
+    async def events(self, backlog: list = None) -> AsyncIterator[dict]:
+        """
+        Yield the backlog (narration missed while disconnected), then live events.
+
+        The subscription is registered before the backlog is read, so events
+        published in between are queued; anything already in the backlog is skipped.
+
+        Raises:
+            SubscriberOverflowError: If live events had to be dropped.
+        """
+        last_id = 0
+        for event in backlog or []:
+            if self.wants(event):
+                yield event
+            last_id = max(last_id, event["id"])
+        while True:
+            if self.overflowed and self._queue.empty():
+                raise SubscriberOverflowError(f"Subscriber fell behind; resume from id {last_id}")
+            event = await self._queue.get()
+            if event["id"] <= last_id:
+                continue
+            last_id = event["id"]
+            yield event
+
+
+class NarrationBroadcaster:
+    """
+    In-process pub/sub of accepted narration, one channel per campaign.
+
+    A narration log is written to the database once and pushed to every
+    connected player it is addressed to, instead of each player polling the log.
+    Channels live in this process only; run the API as a single worker or put a
+    shared broker in front when scaling out.
+    """
+
+    def __init__(self):
+        self._channels = {}
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, campaign_id: int, player: Optional[str] = None) -> Subscription:
+        subscription = Subscription(campaign_id, player)
+        self._channels.setdefault(campaign_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        channel = self._channels.get(subscription.campaign_id)
+        if channel is not None:
+            channel.discard(subscription)
+            if not channel:
+                del self._channels[subscription.campaign_id]
+
+    def publish(self, campaign_id: int, event: dict) -> int:
+        """
+        Push an event to every subscriber of a campaign it is addressed to. Must be
+        called from the event loop.
+
+        Returns:
+            int: The number of subscribers the event was queued for.
+        """
+        self.published += 1
+        delivered = 0
+        for subscription in list(self._channels.get(campaign_id, ())):
+            if not subscription.wants(event):
+                continue
+            if subscription.offer(event):
+                delivered += 1
+            else:
+                self.dropped += 1
+        self.delivered += delivered
+        return delivered
+
+    def stats(self) -> dict:
+        return {
+            "campaigns": len(self._channels),
+            "subscribers": sum(len(channel) for channel in self._channels.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+# Shared by the API process
+narration_broadcaster = NarrationBroadcaster()
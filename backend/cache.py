@@ -0,0 +1,251 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+import numpy as np
+
+# Retrieval cache settings
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "512"))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "600"))
+
+# LLM response cache settings (entries per campaign/model scope)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95"))
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after a fixed time-to-live.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """
+        Drop every entry whose key matches predicate and return how many were dropped.
+        """
+        with self._lock:
+            stale = [key for key in self._entries if predicate(key)]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a query for use in cache keys: case-folded with collapsed whitespace.
+    """
+    return " ".join(query.casefold().split())
+
+
+# Retrieval results keyed by (collection names, normalized query, filters, retrieval mode)
+retrieval_cache = TTLCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL)
+
+# Bumped on every invalidation, so a result computed before a write is never cached after it
+_collection_generations = {}
+_generations_lock = threading.Lock()
+
+
+def _generations(names) -> tuple:
+    return tuple(_collection_generations.get(name, 0) for name in names)
+
+
+def collection_generation(names) -> tuple:
+    """
+    Return the current generation of each named collection; read it before querying
+    and pass it to cache_retrieval.
+    """
+    with _generations_lock:
+        return _generations(names)
+
+
+def cache_retrieval(key: tuple, results: Any, generation: tuple) -> bool:
+    """
+    Store retrieval results unless a collection they searched was invalidated since
+    generation was read.
+
+    Returns:
+        bool: Whether the results were cached.
+    """
+    with _generations_lock:
+        if _generations(key[0]) != generation:
+            return False
+        retrieval_cache.set(key, results)
+        return True
+
+
+def invalidate_collection(name: str) -> int:
+    """
+    Drop cached retrieval results that searched the named collection, and stop
+    results computed before now from being cached.
+    """
+    with _generations_lock:
+        _collection_generations[name] = _collection_generations.get(name, 0) + 1
+        return retrieval_cache.invalidate(lambda key: name in key[0])
+
+
+class ResponseCache:
+    """
+    LLM response cache scoped per (campaign, model).
+
+    Prompts are matched by a hash of their normalized text first, then by cosine
+    similarity of their embeddings against the scope's cached prompts. Each scope
+    holds at most maxsize entries, evicted least recently used first, and entries
+    expire after ttl seconds.
+    """
+
+    def __init__(self, embed: Callable[[list], list], maxsize: int = RESPONSE_CACHE_SIZE,
+                 ttl: float = RESPONSE_CACHE_TTL, threshold: float = RESPONSE_CACHE_THRESHOLD):
+        self.embed = embed
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._scopes = {}
+        # Embeddings computed by a missed lookup, reused when the answer is stored
+        self._pending = TTLCache(64, ttl)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _prompt_hash(prompt: str) -> str:
+        return hashlib.sha256(normalize_query(prompt).encode("utf-8")).hexdigest()
+
+    def _embedding(self, prompt: str, prompt_hash: str) -> np.ndarray:
+        vector = self._pending.get(prompt_hash)
+        if vector is None:
+            vector = np.asarray(self.embed([normalize_query(prompt)])[0], dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            vector = vector / norm if norm else vector
+            self._pending.set(prompt_hash, vector)
+        return vector
+
+    def _live_entries(self, scope_key: tuple, create: bool = False) -> OrderedDict:
+        # Only store() creates scopes, so lookups with arbitrary models cannot grow the
+        # cache; scopes whose entries have all expired are dropped
+        entries = self._scopes.setdefault(scope_key, OrderedDict()) if create else self._scopes.get(scope_key)
+        if entries is None:
+            return OrderedDict()
+        now = time.monotonic()
+        for key in [key for key, entry in entries.items() if entry["expires_at"] <= now]:
+            del entries[key]
+        if not entries and not create:
+            del self._scopes[scope_key]
+        return entries
+
+    def lookup(self, prompt: str, campaign_id: Optional[int], model: str) -> Optional[dict]:
+        """
+        Find a cached response for a prompt.
+
+        Returns:
+            Optional[dict]: {"response", "match", "similarity"} where match is "exact"
+            or "semantic", or None on a miss.
+        """
+        prompt_hash = self._prompt_hash(prompt)
+        scope_key = (campaign_id, model)
+        with self._lock:
+            entries = self._live_entries(scope_key)
+            entry = entries.get(prompt_hash)
+            if entry is not None:
+                entries.move_to_end(prompt_hash)
+                self.exact_hits += 1
+                return {"response": entry["response"], "match": "exact", "similarity": 1.0}
+            if not entries:
+                self.misses += 1
+                return None
+            keys = list(entries)
+            matrix = np.stack([entries[key]["embedding"] for key in keys])
+
+        # Embed outside the lock; it is the expensive part
+        vector = self._embedding(prompt, prompt_hash)
+        similarities = matrix @ vector
+        best = int(np.argmax(similarities))
+
+        with self._lock:
+            entry = self._scopes.get(scope_key, {}).get(keys[best])
+            if entry is not None and similarities[best] >= self.threshold:
+                self._scopes[scope_key].move_to_end(keys[best])
+                self.semantic_hits += 1
+                return {"response": entry["response"], "match": "semantic",
+                        "similarity": round(float(similarities[best]), 4)}
+            self.misses += 1
+        return None
+
+    def store(self, prompt: str, campaign_id: Optional[int], model: str, response: str):
+        prompt_hash = self._prompt_hash(prompt)
+        vector = self._embedding(prompt, prompt_hash)
+        with self._lock:
+            entries = self._live_entries((campaign_id, model), create=True)
+            entries[prompt_hash] = {
+                "embedding": vector,
+                "response": response,
+                "expires_at": time.monotonic() + self.ttl,
+            }
+            entries.move_to_end(prompt_hash)
+            while len(entries) > self.maxsize:
+                entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "scopes": len(self._scopes),
+                "size": sum(len(entries) for entries in self._scopes.values()),
+                "maxsize_per_scope": self.maxsize,
+                "threshold": self.threshold,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.exact_hits + self.semantic_hits) / lookups, 3) if lookups else 0.0,
+            }
@@ -0,0 +1,196 @@
+import os
+import re
+from typing import Iterable, Iterator, Optional, Tuple
+
+# Chunking settings (characters); override through the environment
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+
+# Markdown-style headings or short title lines without sentence punctuation
+HEADING_PATTERN = re.compile(r"^(#{1,6}\s+\S.*|[A-Z0-9][^.!?:;,]{0,79})$")
+BLOCK_SEPARATOR = re.compile(r"\n\s*\n")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def is_heading(line: str, standalone: bool = False) -> bool:
+    """
+    Decide whether a line looks like a section heading.
+
+    Args:
+        line (str): A single stripped line of text.
+        standalone (bool): True when the line is a paragraph of its own; short
+            Title Case lines only count as headings there, so wrapped PDF lines
+            and stat block rows ("Armor Class 15") stay in their paragraph.
+
+    Returns:
+        bool: True for markdown headings, ALL CAPS lines and standalone Title Case lines.
+    """
+    if not line or len(line) > 80 or not HEADING_PATTERN.match(line):
+        return False
+    if line.startswith("#"):
+        return True
+    if any(char.isdigit() for char in line):
+        return False
+    words = [word for word in line.split() if word[:1].isalpha()]
+    if not words or len(words) > 10:
+        return False
+    if line.isupper() and sum(char.isalpha() for char in line) >= 3:
+        return True
+    return standalone and all(word[0].isupper() for word in words)
+
+
+def _split_long_block(block: str, chunk_size: int):
+    """
+    Break a block that is longer than chunk_size on lines, then sentences, then words.
+    """
+    pieces = [block]
+    for pattern in (re.compile(r"\n"), SENTENCE_END, re.compile(r"\s+")):
+        next_pieces = []
+        for piece in pieces:
+            if len(piece) <= chunk_size:
+                next_pieces.append(piece)
+            else:
+                next_pieces.extend(part for part in pattern.split(piece) if part.strip())
+        pieces = next_pieces
+
+    # Hard cut anything that still has no whitespace to split on
+    for piece in pieces:
+        for start in range(0, len(piece), chunk_size):
+            yield piece[start:start + chunk_size]
+
+
+def _overlap_tail(text: str, chunk_overlap: int) -> str:
+    """
+    Return the last chunk_overlap characters of text, starting on a word boundary.
+    """
+    if chunk_overlap <= 0 or not text:
+        return ""
+    tail = text[-chunk_overlap:]
+    if len(text) > chunk_overlap and " " in tail:
+        tail = tail.split(" ", 1)[1]
+    return tail.strip()
+
+
+def iter_chunks(
+    pages: Iterable[Tuple[Optional[int], str]],
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+) -> Iterator[dict]:
+    """
+    Split extracted pages into overlapping chunks on heading and paragraph boundaries.
+
+    Chunks never span pages, so every chunk carries the page it came from. Headings
+    start a new chunk and become the section of every chunk that follows them.
+    Pages are consumed lazily and chunks yielded as soon as they are complete, so
+    only the current page is held in memory.
+
+    Args:
+        pages (Iterable[Tuple[Optional[int], str]]): (page number, text) pairs; the
+            page number is None for formats without pages.
+        chunk_size (int): Target maximum chunk length in characters.
+        chunk_overlap (int): Characters of the previous chunk repeated at the start of
+            the next one when a section is split by size.
+
+    Yields:
+        dict: Chunks with "text", "page", "section" and "chunk_index" keys.
+    """
+    if chunk_overlap >= chunk_size:
+        raise ValueError("chunk_overlap must be smaller than chunk_size")
+
+    chunk_index = 0
+    section = ""
+
+    for page, page_text in pages:
+        if not page_text or not page_text.strip():
+            continue
+        ready = []
+        current, has_body = "", False
+
+        def emit(text):
+            nonlocal chunk_index
+            text = text.strip()
+            if text:
+                ready.append({
+                    "text": text,
+                    "page": page,
+                    "section": section,
+                    "chunk_index": chunk_index,
+                })
+                chunk_index += 1
+
+        def add(paragraph):
+            nonlocal current, has_body
+            has_body = True
+            separator = "\n"
+            for piece in _split_long_block(paragraph, chunk_size):
+                if current and len(current) + len(piece) + 1 > chunk_size:
+                    emit(current)
+                    current = _overlap_tail(current, chunk_overlap)
+                current = f"{current}{separator}{piece}" if current else piece
+                # Pieces after the first were cut mid-paragraph
+                separator = " "
+
+        for block in BLOCK_SEPARATOR.split(page_text):
+            lines = [line.strip() for line in block.splitlines() if line.strip()]
+            paragraph = []
+            for line in lines:
+                if is_heading(line, standalone=len(lines) == 1):
+                    # A heading closes the running chunk and opens a new section
+                    if paragraph:
+                        add(" ".join(paragraph))
+                        paragraph = []
+                    if has_body:
+                        emit(current)
+                        current, has_body = "", False
+                    section = line.lstrip("#").strip()
+                    current = f"{current}\n{line}" if current else line
+                else:
+                    paragraph.append(line)
+            if paragraph:
+                add(" ".join(paragraph))
+            yield from ready
+            ready.clear()
+
+        if has_body:
+            emit(current)
+        yield from ready
+
+
+def chunk_pages(
+    pages: Iterable[Tuple[Optional[int], str]],
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+) -> list:
+    """
+    Chunk pages eagerly; see iter_chunks.
+
+    Returns:
+        list: Dicts with "text", "page", "section" and "chunk_index" keys.
+    """
+    return list(iter_chunks(pages, chunk_size, chunk_overlap))
+
+
+def chunk_metadata(filename: str, chunk: dict, labels: dict = None) -> dict:
+    """
+    Build the ChromaDB metadata for a chunk produced by chunk_pages.
+
+    ChromaDB metadata values cannot be None, so the page and any unset labels are
+    left out.
+
+    Args:
+        filename (str): Name of the source file.
+        chunk (dict): A chunk produced by chunk_pages.
+        labels (dict, optional): File-level labels such as "book" and "type" that
+            retrieval can filter on.
+    """
+    metadata = {
+        "filename": filename,
+        "section": chunk["section"],
+        "chunk_index": chunk["chunk_index"],
+    }
+    if chunk["page"] is not None:
+        metadata["page"] = chunk["page"]
+    for key, value in (labels or {}).items():
+        if value is not None:
+            metadata[key] = value
+    return metadata
@@ -0,0 +1,54 @@
+import os
+import json
+import logging
+from functools import lru_cache
+from typing import Optional
+from dotenv import load_dotenv
+
+# Explicitly load the .env file
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
+
+
+def _env_flag(name: str, default: str = "false") -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+# Diagnostics, all off by default
+DEBUG = _env_flag("DEBUG")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG" if DEBUG else "INFO").upper()
+# Log every SQL statement
+SQL_ECHO = _env_flag("SQL_ECHO")
+# Dump raw HTTP traffic from http.client
+HTTP_DEBUG = _env_flag("HTTP_DEBUG")
+
+# Ollama's local config file; its "id" is sent as the API key
+OLLAMA_CONFIG_PATH = os.getenv("OLLAMA_CONFIG_PATH", r"c:\Users\dougl\AppData\Local\Ollama\config.json")
+
+
+def configure_logging():
+    """
+    Apply the logging settings. Called once when the app starts rather than at
+    import time, so importing a module never changes global logging.
+    """
+    logging.basicConfig(level=LOG_LEVEL)
+    if HTTP_DEBUG:
+        import http.client as http_client
+        http_client.HTTPConnection.debuglevel = 1
+        logging.getLogger("urllib3").setLevel(logging.DEBUG)
+
+
+@lru_cache(maxsize=1)
+def load_ollama_api_key() -> Optional[str]:
+    """
+    Load the API key from the Ollama config.json file, reading it only once.
+
+    Returns:
+        Optional[str]: The config's "id" field, or None if the file is missing or invalid.
+    """
+    try:
+        with open(OLLAMA_CONFIG_PATH, "r") as config_file:
+            config = json.load(config_file)
+    except (OSError, ValueError) as e:
+        print(f"Could not read Ollama config {OLLAMA_CONFIG_PATH}: {e}")  # Debugging: Log the error
+        return None
+    return config.get("id")  # Use the `id` field as the API key
@@ -0,0 +1,176 @@
+import os
+import asyncio
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from backend.database import async_session_maker
+from backend.models import NarrationLog, CampaignSummary
+from backend.utils import get_narration_logs, llm_scheduler, DEFAULT_MODEL
+
+# Narration context settings
+CONTEXT_RECENT_LOGS = int(os.getenv("CONTEXT_RECENT_LOGS", "10"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Share of the budget the rolling summary may claim before recent narration is packed
+SUMMARY_BUDGET_SHARE = 0.3
+SUMMARY_WORD_LIMIT = int(os.getenv("SUMMARY_WORD_LIMIT", "300"))
+# Tokens of older narration folded into the summary per LLM call
+SUMMARY_BATCH_TOKENS = int(os.getenv("SUMMARY_BATCH_TOKENS", "2000"))
+
+SUMMARY_PROMPT = """You maintain the running summary of a Dungeons & Dragons campaign.
+Update the summary with the new events below. Keep every important name, place, quest
+and unresolved thread; drop minor detail. Reply with the updated summary only, in at
+most {word_limit} words.
+
+Current summary:
+{summary}
+
+New events, in order:
+{events}"""
+
+# One summary refresh per campaign at a time
+_summary_locks = {}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (about four characters per token for English prose).
+    """
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cut text to roughly max_tokens, on a word boundary.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    cut = text[:max(0, max_tokens * 4)]
+    return cut.rsplit(" ", 1)[0] if " " in cut else cut
+
+
+async def get_campaign_summary(db: AsyncSession, campaign_id: int):
+    result = await db.execute(select(CampaignSummary).where(CampaignSummary.campaign_id == campaign_id))
+    return result.scalar_one_or_none()
+
+
+async def build_narration_context(db: AsyncSession, campaign_id: int,
+                                  token_budget: int = CONTEXT_TOKEN_BUDGET,
+                                  recent_logs: int = CONTEXT_RECENT_LOGS) -> dict:
+    """
+    Assemble the narration context for a prompt within a token budget.
+
+    The last recent_logs narrations are kept verbatim (newest first until the budget
+    runs out) and everything older is represented by the campaign's rolling summary,
+    so the context stays the same size however long the campaign runs.
+
+    Args:
+        db (AsyncSession): The database session.
+        campaign_id (int): The campaign.
+        token_budget (int): Maximum estimated tokens of context.
+        recent_logs (int): How many of the latest narrations to consider verbatim.
+
+    Returns:
+        dict: "summary", "recent" logs (oldest first), the assembled "text" and its
+        estimated "tokens".
+    """
+    summary_row = await get_campaign_summary(db, campaign_id)
+    summary = summary_row.summary if summary_row else ""
+    page = await get_narration_logs(db, campaign_id, limit=recent_logs)
+
+    # Recent narration gets the budget the summary leaves, newest first
+    reserved = min(estimate_tokens(summary), int(token_budget * SUMMARY_BUDGET_SHARE))
+    remaining = token_budget - reserved
+    recent = []
+    for log in page["items"]:
+        cost = estimate_tokens(log.content)
+        if cost > remaining:
+            break
+        recent.append(log)
+        remaining -= cost
+    recent.reverse()
+
+    summary = truncate_to_tokens(summary, remaining + reserved)
+    sections = []
+    if summary:
+        sections.append(f"Story so far:\n{summary}")
+    if recent:
+        sections.append("Recent narration:\n" + "\n\n".join(log.content for log in recent))
+    text = "\n\n".join(sections)
+
+    return {
+        "campaign_id": campaign_id,
+        "summary": summary,
+        "recent": [{"id": log.id, "content": log.content, "created_at": log.created_at} for log in recent],
+        "text": text,
+        "tokens": estimate_tokens(text),
+    }
+
+
+async def update_rolling_summary(db: AsyncSession, campaign_id: int,
+                                 recent_logs: int = CONTEXT_RECENT_LOGS) -> int:
+    """
+    Fold narration that has left the recent window into the campaign's rolling summary.
+
+    Only logs newer than the summary's high-water mark are read and sent to the LLM,
+    in batches of about SUMMARY_BATCH_TOKENS, so each update costs the same however
+    old the campaign is.
+
+    Returns:
+        int: The number of logs folded into the summary.
+    """
+    page = await get_narration_logs(db, campaign_id, limit=recent_logs)
+    if len(page["items"]) < recent_logs:
+        return 0
+    window_start_id = page["items"][-1].id
+
+    summary_row = await get_campaign_summary(db, campaign_id)
+    if summary_row is None:
+        summary_row = CampaignSummary(campaign_id=campaign_id, summary="", summarized_through_id=0)
+        db.add(summary_row)
+
+    folded = 0
+    while True:
+        result = await db.execute(
+            select(NarrationLog)
+            .where(NarrationLog.campaign_id == campaign_id,
+                   NarrationLog.id > summary_row.summarized_through_id,
+                   NarrationLog.id < window_start_id)
+            .order_by(NarrationLog.id)
+            .limit(100)
+        )
+        pending = result.scalars().all()
+        if not pending:
+            break
+
+        batch, batch_tokens = [], 0
+        for log in pending:
+            cost = estimate_tokens(log.content)
+            if batch and batch_tokens + cost > SUMMARY_BATCH_TOKENS:
+                break
+            batch.append(log)
+            batch_tokens += cost
+
+        prompt = SUMMARY_PROMPT.format(
+            word_limit=SUMMARY_WORD_LIMIT,
+            summary=summary_row.summary or "(none yet)",
+            events="\n\n".join(truncate_to_tokens(log.content, SUMMARY_BATCH_TOKENS) for log in batch),
+        )
+        summary_row.summary = (await llm_scheduler.generate(prompt, DEFAULT_MODEL, "background")).strip()
+        summary_row.summarized_through_id = batch[-1].id
+        await db.commit()
+        folded += len(batch)
+
+    return folded
+
+
+async def refresh_rolling_summary(campaign_id: int):
+    """
+    Background task run after a narration log is added: update the campaign's rolling
+    summary in its own database session.
+    """
+    lock = _summary_locks.setdefault(campaign_id, asyncio.Lock())
+    async with lock:
+        try:
+            async with async_session_maker() as db:
+                await update_rolling_summary(db, campaign_id)
+        except Exception as e:
+            print(f"Error updating summary for campaign {campaign_id}: {e}")  # Debugging: Log the error
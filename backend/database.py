@@ -1,20 +1,21 @@
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 import os
-from dotenv import load_dotenv
-
-# Explicitly load the .env file
-load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
+from backend.config import DEBUG, SQL_ECHO
+from backend.metrics import install_sql_timing
 
 # Debug: Print loaded environment variables
-print(f"DB_USER: {os.getenv('DB_USER')}, DB_PASSWORD: {os.getenv('DB_PASSWORD')}")
-print(f"Loaded DB_PORT: {os.getenv('DB_PORT')}")
+if DEBUG:
+    print(f"DB_USER: {os.getenv('DB_USER')}, DB_HOST: {os.getenv('DB_HOST', 'localhost')}")
+    print(f"Loaded DB_PORT: {os.getenv('DB_PORT')}")
 
-# Database connection URL
-DATABASE_URL = f"postgresql+asyncpg://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST', 'localhost')}:{os.getenv('DB_PORT', '5432')}/{os.getenv('DB_NAME')}"
+# Database connection URL; DATABASE_URL overrides the Postgres settings (e.g. for benchmarks)
+DATABASE_URL = os.getenv("DATABASE_URL") or f"postgresql+asyncpg://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST', 'localhost')}:{os.getenv('DB_PORT', '5432')}/{os.getenv('DB_NAME')}"
 
 # Create the database engine
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = create_async_engine(DATABASE_URL, echo=SQL_ECHO)
+# Time every statement for /metrics
+install_sql_timing(engine.sync_engine)
 
 # Create a sessionmaker for database sessions
 async_session_maker = sessionmaker(
@@ -0,0 +1,240 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+import numpy as np
+from backend.metrics import span, embedded_texts
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Where chunk embeddings are cached, one vector file per model
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join("chroma_data", "embeddings"))
+# ChromaDB's default embedding function, also used to embed queries
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# Texts per call to the embedding model
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+
+# Same embedding model ChromaDB uses for collections, created on first use
+_embedding_function = None
+
+
+def embed_texts(texts: list) -> list:
+    """
+    Embed texts with the model ChromaDB uses for the sourcebook collections.
+    """
+    global _embedding_function
+    if _embedding_function is None:
+        from chromadb.utils import embedding_functions
+        _embedding_function = embedding_functions.DefaultEmbeddingFunction()
+    embedded_texts.inc(len(texts))
+    with span("embed"):
+        return _embedding_function(texts)
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of chunk embeddings for one model, keyed by the hash of the text.
+
+    Vectors are appended to a flat float32 file that is memory-mapped for reads, and
+    their keys to a parallel text file (line n is the key of row n), so the cache
+    never has to be rewritten and only the rows that are read are paged in.
+
+    Several instances (e.g. the API and the ingest CLI) may share a directory:
+    appends hold an exclusive lock on a lock file, and each instance first picks up
+    the rows the others appended, so every instance appends after the last row.
+    """
+
+    def __init__(self, model_name: str, directory: str = EMBEDDING_CACHE_DIR):
+        stem = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+        directory = Path(directory)
+        self.model_name = model_name
+        self.vectors_path = directory / f"{stem}.f32"
+        self.keys_path = directory / f"{stem}.keys"
+        self.meta_path = directory / f"{stem}.json"
+        self.lock_path = directory / f"{stem}.lock"
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._dim = None
+        self._matrix = None
+        # Rows and bytes of the keys file already read; a key appended twice (only
+        # possible without fcntl) still takes a row, so rows can outnumber _rows
+        self._row_count = 0
+        self._keys_size = 0
+        with self._file_lock():
+            self._sync()
+
+    @contextmanager
+    def _file_lock(self):
+        # Serializes appends across processes; on platforms without fcntl only
+        # instances in this process are serialized (by the singleton and _lock)
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """
+        Pick up rows appended since the last sync, then cut off what an interrupted
+        append left behind. Must be called with the file lock held.
+        """
+        if self._dim is None:
+            if not self.meta_path.exists():
+                return
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self._dim = json.load(f)["dim"]
+        row_bytes = 4 * self._dim
+        complete_rows = os.path.getsize(self.vectors_path) // row_bytes if self.vectors_path.exists() else 0
+        if self.keys_path.exists():
+            with open(self.keys_path, "rb") as f:
+                f.seek(self._keys_size)
+                for line in f:
+                    # A key only counts once its vector is complete and its line is whole
+                    if self._row_count >= complete_rows or not line.endswith(b"\n"):
+                        break
+                    self._rows.setdefault(line[:-1].decode("utf-8"), self._row_count)
+                    self._row_count += 1
+                    self._keys_size += len(line)
+        # Appends are serialized by the file lock, so anything past the last complete
+        # row with a key was left by an append that failed or crashed: a torn row, a
+        # vector without its key or a torn key line
+        for path, size in ((self.vectors_path, self._row_count * row_bytes), (self.keys_path, self._keys_size)):
+            if path.exists() and os.path.getsize(path) > size:
+                os.truncate(path, size)
+                self._matrix = None
+
+    def _vectors(self) -> np.ndarray:
+        # Re-map after appends so new rows are visible
+        if self._matrix is None or len(self._matrix) < self._row_count:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r").reshape(-1, self._dim)
+        return self._matrix
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get_many(self, keys: list) -> list:
+        """
+        Return the cached vector for each key, or None where it is not cached.
+        """
+        with self._lock:
+            rows = [self._rows.get(key) for key in keys]
+            found = [row for row in rows if row is not None]
+            self.hits += len(found)
+            self.misses += len(rows) - len(found)
+            if not found:
+                return [None] * len(keys)
+            vectors = self._vectors()
+            return [None if row is None else np.array(vectors[row]) for row in rows]
+
+    def put_many(self, keys: list, vectors: list):
+        """
+        Append vectors for keys not cached yet.
+        """
+        matrix = np.asarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock():
+            # Another instance may have appended rows (or written the metadata) meanwhile
+            self._sync()
+            if self._dim is None:
+                self._dim = int(matrix.shape[1])
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"model": self.model_name, "dim": self._dim}, f)
+            new_keys, new_rows, seen = [], [], set(self._rows)
+            for key, vector in zip(keys, matrix):
+                if key not in seen:
+                    seen.add(key)
+                    new_keys.append(key)
+                    new_rows.append(vector)
+            if not new_keys:
+                return
+            # Keys are appended only once their vectors are written, so a key never
+            # points past the data; a vector without a key is cut off by the next sync
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.stack(new_rows).tobytes())
+            key_bytes = "".join(f"{key}\n" for key in new_keys).encode("utf-8")
+            with open(self.keys_path, "ab") as f:
+                f.write(key_bytes)
+            for key in new_keys:
+                self._rows[key] = self._row_count
+                self._row_count += 1
+            self._keys_size += len(key_bytes)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "model": self.model_name,
+                "entries": len(self._rows),
+                "dim": self._dim,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Persistent cache of chunk embeddings for the collection model, opened on first use
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _embedding_cache
+    if _embedding_cache is not None:
+        return _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(EMBEDDING_MODEL)
+        return _embedding_cache
+
+
+def embed_chunks(texts: list, batch_size: int = EMBED_BATCH_SIZE,
+                 cache: Optional[EmbeddingCache] = None) -> list:
+    """
+    Embed chunk texts, reusing cached vectors and batching the rest.
+
+    Only texts missing from the cache reach the model, each distinct text once, in
+    calls of batch_size; their vectors are added to the cache.
+
+    Args:
+        texts (list): The chunk texts.
+        batch_size (int): Texts per call to the embedding model.
+        cache (EmbeddingCache, optional): Defaults to the shared cache (get_embedding_cache).
+
+    Returns:
+        list: One float32 vector per text, in order.
+    """
+    if cache is None:
+        cache = get_embedding_cache()
+    keys = [text_hash(text) for text in texts]
+    vectors = cache.get_many(keys)
+
+    missing = {}
+    for key, text, vector in zip(keys, texts, vectors):
+        if vector is None:
+            missing.setdefault(key, text)
+    computed = {}
+    pending = list(missing.items())
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        batch_vectors = embed_texts([text for _, text in batch])
+        cache.put_many([key for key, _ in batch], batch_vectors)
+        for (key, _), vector in zip(batch, batch_vectors):
+            computed[key] = np.asarray(vector, dtype=np.float32)
+
+    return [vector if vector is not None else computed[key] for key, vector in zip(keys, vectors)]
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator, Union
+from backend.chunking import CHUNK_SIZE, iter_chunks
+
+# File types the extractors understand
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt")
+
+# Formats without pages are handed to the chunker in blocks of about this many characters
+TEXT_BLOCK_SIZE = int(os.getenv("TEXT_BLOCK_SIZE", str(CHUNK_SIZE * 16)))
+
+
+def _paragraph_blocks(paragraphs: Iterable[str], block_size: int = TEXT_BLOCK_SIZE) -> Iterator[str]:
+    # Group paragraphs into blocks, breaking only between paragraphs
+    block, size = [], 0
+    for paragraph in paragraphs:
+        if block and size + len(paragraph) > block_size:
+            # Blank lines between paragraphs let the chunker see paragraph boundaries
+            yield "\n\n".join(block)
+            block, size = [], 0
+        block.append(paragraph)
+        size += len(paragraph) + 2
+    if block:
+        yield "\n\n".join(block)
+
+
+def _text_paragraphs(txt_file) -> Iterator[str]:
+    # Read a text file paragraph by paragraph (blank-line separated)
+    lines = []
+    for line in txt_file:
+        if line.strip():
+            lines.append(line)
+        elif lines:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+
+def iter_pages(file: Path) -> Iterator[tuple]:
+    """
+    Extract the text of a sourcebook lazily, one page (or block) at a time.
+
+    Args:
+        file (Path): Path to a PDF, DOCX or TXT file.
+
+    Yields:
+        tuple: (page number, text) pairs. PDF pages are numbered from 1; DOCX and TXT
+        files have no pages and yield blocks of paragraphs with page None.
+        Unsupported file types yield nothing.
+    """
+    # Parsers are imported on first use to keep them out of the API's startup
+    suffix = file.suffix.lower()
+    if suffix == ".pdf":
+        import PyPDF2
+        with open(file, "rb") as pdf_file:
+            reader = PyPDF2.PdfReader(pdf_file)
+            for page_number, page in enumerate(reader.pages, start=1):
+                yield page_number, page.extract_text() or ""
+    elif suffix == ".docx":
+        import docx
+        doc = docx.Document(file)
+        for block in _paragraph_blocks(paragraph.text for paragraph in doc.paragraphs):
+            yield None, block
+    elif suffix == ".txt":
+        with open(file, "r", encoding="utf-8") as txt_file:
+            for block in _paragraph_blocks(_text_paragraphs(txt_file)):
+                yield None, block
+
+
+def extract_pages(file: Path) -> list:
+    """
+    Extract every page of a sourcebook at once; see iter_pages.
+    """
+    return list(iter_pages(file))
+
+
+def iter_file_chunks(file: Union[str, Path]) -> Iterator[dict]:
+    """
+    Extract and chunk a single sourcebook lazily, so peak memory is one page and
+    the chunks not yet consumed rather than the whole book.
+    """
+    return iter_chunks(iter_pages(Path(file)))
+
+
+def extract_chunks(file: Union[str, Path]) -> list:
+    """
+    Extract and chunk a single sourcebook.
+
+    Args:
+        file (Union[str, Path]): Path to a PDF, DOCX or TXT file.
+
+    Returns:
+        list: Chunks produced by chunk_pages.
+    """
+    return list(iter_file_chunks(file))
+
+
+def iter_batches(items: Iterable, size: int) -> Iterator[list]:
+    """
+    Group an iterable into lists of at most size items.
+    """
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def spool_chunks(file: Union[str, Path], spool_path: Union[str, Path]) -> int:
+    """
+    Extract and chunk a sourcebook into a JSON-lines spool file.
+
+    This is a module-level function with light imports so it can run in a
+    process pool, keeping CPU-bound PDF parsing off the API process; chunks are
+    written as they are produced instead of being pickled back as one list.
+
+    Returns:
+        int: The number of chunks written.
+    """
+    count = 0
+    with open(spool_path, "w", encoding="utf-8") as spool:
+        for chunk in iter_file_chunks(file):
+            spool.write(json.dumps(chunk) + "\n")
+            count += 1
+    return count
+
+
+def read_spool(spool_path: Union[str, Path]) -> Iterator[dict]:
+    """
+    Read chunks back from a spool file written by spool_chunks, one at a time.
+    """
+    with open(spool_path, "r", encoding="utf-8") as spool:
+        for line in spool:
+            yield json.loads(line)
+
+
+def timed_spool_chunks(file: Union[str, Path], spool_path: Union[str, Path]) -> tuple:
+    """
+    Run spool_chunks and time it in the worker process.
+
+    Returns:
+        tuple: (chunks written, seconds spent extracting and chunking).
+    """
+    started = time.perf_counter()
+    count = spool_chunks(file, spool_path)
+    return count, time.perf_counter() - started
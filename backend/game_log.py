@@ -0,0 +1,243 @@
+import os
+import asyncio
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy.future import select
+from backend.database import async_session_maker
+from backend.models import NarrationLog, Session
+from backend.context import estimate_tokens, truncate_to_tokens
+from backend.utils import llm_scheduler, save_session_story, DEFAULT_MODEL
+
+# Session summarization settings
+GAME_LOG_WINDOW_TOKENS = int(os.getenv("GAME_LOG_WINDOW_TOKENS", "2000"))
+GAME_LOG_PART_WORDS = int(os.getenv("GAME_LOG_PART_WORDS", "200"))
+GAME_LOG_STORY_WORDS = int(os.getenv("GAME_LOG_STORY_WORDS", "800"))
+MAX_FINISHED_JOBS = 100
+
+PART_PROMPT = """You are writing the game log of a Dungeons & Dragons session. Below
+is part {part} of {parts} of the session's narration, in order. Summarize the key events,
+decisions, characters and places in this part in at most {word_limit} words. Write plain
+prose and do not add anything that did not happen.
+
+Narration:
+{events}"""
+
+MERGE_PROMPT = """You are writing the game log of a Dungeons & Dragons session. Below are
+consecutive summaries of parts of the session, in order. Combine them into one summary of
+at most {word_limit} words that keeps every key event, decision, character and place.
+
+Summaries:
+{summaries}"""
+
+STORY_PROMPT = """You are writing the game log of a Dungeons & Dragons session. Below are
+summaries of the whole session, in order. Retell the session as a short story of at most
+{word_limit} words, in the past tense, keeping every key event in the order it happened.
+
+Summaries:
+{summaries}"""
+
+
+def split_into_windows(texts: list, token_budget: int = GAME_LOG_WINDOW_TOKENS) -> list:
+    """
+    Group texts, in order, into windows of at most token_budget estimated tokens.
+
+    A text longer than the budget is truncated to fill a window on its own.
+
+    Returns:
+        list: Lists of texts, one per window.
+    """
+    windows, current, current_tokens = [], [], 0
+    for text in texts:
+        text = truncate_to_tokens(text, token_budget)
+        cost = estimate_tokens(text)
+        if current and current_tokens + cost > token_budget:
+            windows.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += cost
+    if current:
+        windows.append(current)
+    return windows
+
+
+class GameLogJob:
+    """
+    Status and progress of one session's summarization into a game log.
+    """
+
+    def __init__(self, campaign_id: int, session_id: int, model: str = DEFAULT_MODEL):
+        self.id = str(uuid.uuid4())
+        self.campaign_id = campaign_id
+        self.session_id = session_id
+        self.model = model
+        self.status = "queued"
+        self.logs = 0
+        self.windows = 0
+        # LLM calls planned so far and finished; reduce rounds add to the plan
+        self.planned_calls = 0
+        self.completed_calls = 0
+        self.error = None
+        self.created_at = datetime.now(timezone.utc)
+        self.finished_at = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_dict(self) -> dict:
+        progress = 1.0 if self.status == "done" else (
+            self.completed_calls / self.planned_calls if self.planned_calls else 0.0
+        )
+        return {
+            "job_id": self.id,
+            "campaign_id": self.campaign_id,
+            "session_id": self.session_id,
+            "status": self.status,
+            "progress": round(progress, 3),
+            "logs": self.logs,
+            "windows": self.windows,
+            "planned_calls": self.planned_calls,
+            "completed_calls": self.completed_calls,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+async def _summarize(job: GameLogJob, prompt: str) -> str:
+    summary = (await llm_scheduler.generate(prompt, job.model, "background")).strip()
+    job.completed_calls += 1
+    return summary
+
+
+async def reduce_summaries(job: GameLogJob, summaries: list,
+                           token_budget: int = GAME_LOG_WINDOW_TOKENS) -> list:
+    """
+    Merge summaries level by level until they fit in one window together.
+
+    Each level merges window-sized groups concurrently, so a long session needs
+    only a few levels rather than one call per summary.
+    """
+    while len(summaries) > 1 and sum(estimate_tokens(summary) for summary in summaries) > token_budget:
+        groups = split_into_windows(summaries, token_budget)
+        if len(groups) == len(summaries):
+            # Every summary fills a window on its own; merge neighbours instead
+            groups = [summaries[start:start + 2] for start in range(0, len(summaries), 2)]
+        job.planned_calls += len(groups)
+        summaries = await asyncio.gather(*(
+            _summarize(job, MERGE_PROMPT.format(word_limit=GAME_LOG_PART_WORDS, summaries="\n\n".join(group)))
+            for group in groups
+        ))
+    return list(summaries)
+
+
+async def write_game_log(job: GameLogJob) -> Optional[str]:
+    """
+    Summarize a closed session's narration into a short story and store it.
+
+    The session's narration logs are split into token-bounded windows that are
+    summarized concurrently (map), then the partial summaries are merged and
+    retold as one story (reduce). The map calls run at background priority, so the
+    scheduler spreads them over whatever Ollama capacity live narration leaves
+    free, and the whole session takes about as long as a few windows rather
+    than one window after another.
+
+    Returns:
+        Optional[str]: The story, or None if the session had no narration.
+    """
+    # The session's bounds are compared in the database, on the same clock that stamped the logs
+    bounds = select(Session.start_time, Session.end_time).where(Session.id == job.session_id).subquery()
+    async with async_session_maker() as db:
+        result = await db.execute(
+            select(NarrationLog.content)
+            .join(bounds, NarrationLog.created_at.between(bounds.c.start_time, bounds.c.end_time))
+            .where(NarrationLog.campaign_id == job.campaign_id)
+            .order_by(NarrationLog.created_at, NarrationLog.id)
+        )
+        texts = result.scalars().all()
+
+    job.logs = len(texts)
+    if not texts:
+        story = None
+    else:
+        windows = split_into_windows(texts)
+        job.windows = len(windows)
+        # One call per window plus the final story
+        job.planned_calls = len(windows) + 1
+        job.status = "summarizing"
+        summaries = await asyncio.gather(*(
+            _summarize(job, PART_PROMPT.format(part=number, parts=len(windows), word_limit=GAME_LOG_PART_WORDS,
+                                               events="\n\n".join(window)))
+            for number, window in enumerate(windows, start=1)
+        ))
+
+        job.status = "reducing"
+        summaries = await reduce_summaries(job, summaries)
+        job.status = "writing"
+        story = await _summarize(job, STORY_PROMPT.format(word_limit=GAME_LOG_STORY_WORDS,
+                                                          summaries="\n\n".join(summaries)))
+
+    async with async_session_maker() as db:
+        await save_session_story(db, job.session_id, story)
+    return story
+
+
+class GameLogWriter:
+    """
+    Runs session summarizations as background tasks and tracks their progress.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self._tasks = set()
+
+    def submit(self, campaign_id: int, session_id: int, model: str = DEFAULT_MODEL) -> GameLogJob:
+        """
+        Start summarizing a closed session, or return its summarization if one is running.
+
+        Returns:
+            GameLogJob: The job; poll get_for_session() for progress.
+        """
+        running = self.get_for_session(session_id)
+        if running is not None and not running.finished:
+            return running
+        job = GameLogJob(campaign_id, session_id, model)
+        self.jobs[job.id] = job
+        task = asyncio.create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self._prune()
+        return job
+
+    def get_for_session(self, session_id: int) -> Optional[GameLogJob]:
+        # The latest job for the session
+        for job in reversed(list(self.jobs.values())):
+            if job.session_id == session_id:
+                return job
+        return None
+
+    async def _run(self, job: GameLogJob):
+        try:
+            await write_game_log(job)
+            job.status = "done"
+        except Exception as e:
+            print(f"Error writing game log for session {job.session_id}: {e}")  # Debugging: Log the error
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = datetime.now(timezone.utc)
+
+    async def stop(self):
+        """
+        Cancel running summarizations.
+        """
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _prune(self):
+        # Forget the oldest finished jobs so the registry stays bounded
+        finished = [job for job in self.jobs.values() if job.finished]
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job.id]
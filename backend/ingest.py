@@ -0,0 +1,184 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Optional, Union
+from backend.extraction import SUPPORTED_EXTENSIONS, timed_spool_chunks, read_spool
+from backend.manifest import hash_file
+from backend.utils import (
+    get_sourcebook_collection, get_manifest, get_lexical_index, sourcebook_labels, check_indexed,
+    find_moved_source, move_indexed_file, index_chunks, remove_indexed_file
+)
+
+# Worker processes for bulk ingestion; one per core by default
+BULK_INGEST_PROCESSES = int(os.getenv("BULK_INGEST_PROCESSES", str(os.cpu_count() or 1)))
+BULK_INGEST_BATCH_SIZE = int(os.getenv("BULK_INGEST_BATCH_SIZE", "512"))
+
+
+def discover_files(path: Union[str, Path]) -> list:
+    """
+    Return every supported sourcebook under a directory (recursively), or the
+    file itself, sorted largest first so the longest extractions start early.
+    """
+    path = Path(path)
+    if path.is_file():
+        return [path] if path.suffix.lower() in SUPPORTED_EXTENSIONS else []
+    files = [file for file in path.rglob("*") if file.is_file() and file.suffix.lower() in SUPPORTED_EXTENSIONS]
+    return sorted(files, key=lambda file: file.stat().st_size, reverse=True)
+
+
+def ingest_directory(path: Union[str, Path], campaign_id: Optional[int] = None, book: str = None,
+                     doc_type: str = None, processes: int = BULK_INGEST_PROCESSES,
+                     batch_size: int = BULK_INGEST_BATCH_SIZE) -> dict:
+    """
+    Ingest a library of sourcebooks using every core.
+
+    Files are found recursively. Hashing and extraction run in a process pool,
+    and each extracted file is spooled to disk. This process is the only writer:
+    it indexes files in the order their extraction finishes, batching ChromaDB
+    writes, while the pool keeps extracting the rest. Files already indexed with
+    the same content are skipped, renamed or moved files keep their chunks under
+    the new path, and indexed files that were removed from the directory are
+    pruned.
+
+    Args:
+        path (Union[str, Path]): A directory (or a single file) to ingest.
+        campaign_id (Optional[int]): Campaign whose collection receives the files;
+            None stores them in the shared core rules collection.
+        book (str, optional): Book label for every file; defaults to each file name.
+        doc_type (str, optional): Type label for every file, e.g. "rules".
+        processes (int): Extraction worker processes.
+        batch_size (int): Chunks embedded and written per ChromaDB call.
+
+    Returns:
+        dict: Per-file results ("files") with timings and chunk counts, and totals
+        including elapsed seconds and chunks and megabytes per second.
+    """
+    path = Path(path)
+    if not path.exists():
+        return {"error": f"Path '{path}' does not exist."}
+
+    started = time.perf_counter()
+    collection = get_sourcebook_collection(campaign_id)
+    files = discover_files(path)
+    results = []
+
+    removed_files = []
+    # Each BM25 save rewrites the whole index, so it is saved once for the run
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, processes)) as pool, \
+                tempfile.TemporaryDirectory(prefix="ingest-") as spool_dir:
+            hashes = dict(zip(files, pool.map(hash_file, files, chunksize=4)))
+
+            futures = {}
+            for number, file in enumerate(files):
+                source = str(file.resolve())
+                skipped = check_indexed(collection, source, hashes[file])
+                if skipped:
+                    results.append({"file": str(file), "status": "skipped", "reason": skipped})
+                    continue
+                # A renamed or moved file keeps its chunks under the new path instead of being pruned
+                moved_from = find_moved_source(collection, source, hashes[file])
+                if moved_from:
+                    chunks = move_indexed_file(collection, moved_from, source, file.name, hashes[file],
+                                               sourcebook_labels(file.name, book, doc_type), batch_size, save=False)
+                    results.append({"file": str(file), "status": "moved", "moved_from": moved_from, "chunks": chunks})
+                    continue
+                spool_path = os.path.join(spool_dir, f"{number}.jsonl")
+                futures[pool.submit(timed_spool_chunks, str(file), spool_path)] = (file, source, spool_path)
+
+            # Single writer: index each file as soon as its extraction finishes
+            for future in as_completed(futures):
+                file, source, spool_path = futures[future]
+                result = {"file": str(file), "bytes": file.stat().st_size}
+                try:
+                    result["chunks"], result["extract_seconds"] = future.result()
+                    index_started = time.perf_counter()
+                    counts = index_chunks(collection, source, file.name, hashes[file], read_spool(spool_path),
+                                          sourcebook_labels(file.name, book, doc_type), batch_size, save=False)
+                    result.update(counts, status="indexed", index_seconds=time.perf_counter() - index_started)
+                except Exception as e:
+                    print(f"Error ingesting {file}: {e}")  # Debugging: Log the error
+                    result.update(status="failed", error=str(e))
+                finally:
+                    if os.path.exists(spool_path):
+                        os.remove(spool_path)
+                for key in ("extract_seconds", "index_seconds"):
+                    if key in result:
+                        result[key] = round(result[key], 3)
+                results.append(result)
+
+        if path.is_dir():
+            present = {str(file.resolve()) for file in files}
+            for source in get_manifest(collection).sources_under(path, recursive=True):
+                if source not in present:
+                    remove_indexed_file(collection, source, save=False)
+                    removed_files.append(source)
+    finally:
+        get_lexical_index(collection).save()
+
+    elapsed = time.perf_counter() - started
+    indexed = [result for result in results if result["status"] == "indexed"]
+    chunks = sum(result["chunks"] for result in indexed)
+    megabytes = sum(result["bytes"] for result in indexed) / (1024 * 1024)
+    return {
+        "files": results,
+        "removed_files": removed_files,
+        "totals": {
+            "discovered": len(files),
+            "indexed": len(indexed),
+            "skipped": sum(1 for result in results if result["status"] == "skipped"),
+            "moved": sum(1 for result in results if result["status"] == "moved"),
+            "failed": sum(1 for result in results if result["status"] == "failed"),
+            "chunks": chunks,
+            "elapsed_seconds": round(elapsed, 3),
+            "chunks_per_second": round(chunks / elapsed, 1) if elapsed else 0.0,
+            "megabytes_per_second": round(megabytes / elapsed, 2) if elapsed else 0.0,
+        },
+    }
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Ingest a directory of sourcebooks in parallel.")
+    parser.add_argument("path", help="Directory (searched recursively) or file to ingest")
+    parser.add_argument("--campaign-id", type=int, default=None,
+                        help="Campaign collection to ingest into (default: shared core rules)")
+    parser.add_argument("--book", default=None, help="Book label for every file (default: file name)")
+    parser.add_argument("--type", dest="doc_type", default=None, help="Type label for every file, e.g. rules")
+    parser.add_argument("--processes", type=int, default=BULK_INGEST_PROCESSES, help="Extraction worker processes")
+    parser.add_argument("--batch-size", type=int, default=BULK_INGEST_BATCH_SIZE, help="Chunks per ChromaDB write")
+    parser.add_argument("--json", action="store_true", help="Print the full report as JSON")
+    args = parser.parse_args(argv)
+
+    report = ingest_directory(args.path, args.campaign_id, args.book, args.doc_type, args.processes, args.batch_size)
+    if args.json or "error" in report:
+        print(json.dumps(report, indent=2))
+        return 1 if "error" in report else 0
+
+    for result in report["files"]:
+        if result["status"] == "indexed":
+            print(f"{result['file']}: {result['chunks']} chunks "
+                  f"(+{result['added']} ~{result['kept']} -{result['removed']}), "
+                  f"extract {result['extract_seconds']}s, index {result['index_seconds']}s")
+        elif result["status"] == "skipped":
+            print(f"{result['file']}: skipped ({result['reason']})")
+        elif result["status"] == "moved":
+            print(f"{result['file']}: moved from {result['moved_from']} ({result['chunks']} chunks)")
+        else:
+            print(f"{result['file']}: failed ({result['error']})")
+    for source in report["removed_files"]:
+        print(f"{source}: removed")
+    totals = report["totals"]
+    print(f"{totals['indexed']} indexed, {totals['moved']} moved, {totals['skipped']} skipped, "
+          f"{totals['failed']} failed of "
+          f"{totals['discovered']} files; {totals['chunks']} chunks in {totals['elapsed_seconds']}s "
+          f"({totals['chunks_per_second']} chunks/s, {totals['megabytes_per_second']} MB/s)")
+    return 1 if totals["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+import os
+import asyncio
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+from backend.extraction import spool_chunks, read_spool
+from backend.manifest import hash_file
+from backend.metrics import span
+from backend.utils import (
+    get_sourcebook_collection, collection_name, sourcebook_labels, check_indexed, index_chunks
+)
+
+# Ingestion settings
+INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES", str(max(1, (os.cpu_count() or 2) // 2))))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+# Uploaded sourcebooks, one directory per collection
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploaded_files")
+MAX_FINISHED_JOBS = 100
+
+
+def staging_path(job_id: str, filename: str) -> str:
+    """
+    Where an upload is written before its job runs; unique per job, so uploads
+    with the same name never overwrite each other while queued.
+    """
+    return os.path.join(UPLOAD_DIR, ".incoming", job_id, filename)
+
+
+def upload_path(campaign_id: Optional[int], filename: str) -> Path:
+    """
+    Where an uploaded file is kept once ingested. The path, and so the manifest key,
+    depends only on the collection and the file name, so uploading a revised book
+    re-indexes it in place instead of adding a second copy.
+    """
+    return Path(UPLOAD_DIR) / collection_name(campaign_id) / filename
+
+
+def _place_upload(staged_path: str, target: Path):
+    # Replace the earlier upload of the same name and drop the job's staging directory
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(staged_path, target)
+    try:
+        os.rmdir(os.path.dirname(staged_path))
+    except OSError:
+        pass
+
+
+class IngestJob:
+    """
+    Status and progress of one queued sourcebook ingestion.
+    """
+
+    def __init__(self, file_path: str, filename: str, campaign_id: Optional[int] = None,
+                 book: str = None, doc_type: str = None, job_id: str = None):
+        self.id = job_id or str(uuid.uuid4())
+        self.file_path = file_path
+        self.filename = filename
+        self.campaign_id = campaign_id
+        self.labels = sourcebook_labels(filename, book, doc_type)
+        self.status = "queued"
+        self.total_chunks = 0
+        self.stored_chunks = 0
+        self.skipped = None
+        self.error = None
+        self.created_at = datetime.now(timezone.utc)
+        self.finished_at = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_dict(self) -> dict:
+        progress = 1.0 if self.status == "done" else (
+            self.stored_chunks / self.total_chunks if self.total_chunks else 0.0
+        )
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "campaign_id": self.campaign_id,
+            **self.labels,
+            "status": self.status,
+            "progress": round(progress, 3),
+            "total_chunks": self.total_chunks,
+            "stored_chunks": self.stored_chunks,
+            "skipped": self.skipped,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class IngestQueue:
+    """
+    Background queue that extracts uploaded sourcebooks in a process pool and stores
+    their chunks in ChromaDB without blocking the event loop.
+    """
+
+    def __init__(self, processes: int = INGEST_PROCESSES, workers: int = INGEST_WORKERS):
+        self.processes = processes
+        self.workers = workers
+        self.jobs = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._tasks = []
+        # Per upload path: [lock, jobs holding or waiting for it]
+        self._path_locks = {}
+
+    def start(self):
+        """
+        Start the worker tasks; must be called from the running event loop.
+        """
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._executor = ProcessPoolExecutor(max_workers=self.processes)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        Cancel the workers and shut the process pool down.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, file_path: str, filename: str, campaign_id: Optional[int] = None,
+               book: str = None, doc_type: str = None, job_id: str = None) -> IngestJob:
+        """
+        Queue a saved file for ingestion.
+
+        Args:
+            file_path (str): Where the upload was written on disk (see staging_path);
+                the job moves it to upload_path() before indexing.
+            filename (str): The original file name, stored in chunk metadata.
+            campaign_id (Optional[int]): Campaign collection to index into; None
+                means the shared core rules collection.
+            book (str, optional): Book label; defaults to the file name.
+            doc_type (str, optional): Type label, e.g. "rules".
+            job_id (str, optional): Id for the job, e.g. one already used to name
+                the upload's directory; a new one is generated by default.
+
+        Returns:
+            IngestJob: The queued job; poll get() with its id for progress.
+        """
+        if not self._tasks:
+            self.start()
+        job = IngestJob(file_path, filename, campaign_id, book, doc_type, job_id)
+        self.jobs[job.id] = job
+        self._queue.put_nowait(job)
+        self._prune()
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self.jobs.get(job_id)
+
+    def _prune(self):
+        # Forget the oldest finished jobs so the registry stays bounded
+        finished = [job for job in self.jobs.values() if job.finished]
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job.id]
+
+    @staticmethod
+    def _progress_callback(job: IngestJob):
+        def on_progress(written: int):
+            job.stored_chunks += written
+        return on_progress
+
+    @asynccontextmanager
+    async def _path_lock(self, path: Path):
+        # Jobs for the same upload path run one at a time, so the last upload wins
+        key = str(path)
+        entry = self._path_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._path_locks[key]
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            try:
+                target = upload_path(job.campaign_id, job.filename)
+                async with self._path_lock(target):
+                    await asyncio.to_thread(_place_upload, job.file_path, target)
+                    job.file_path = str(target)
+                    await self._ingest(job, loop)
+                job.status = "done"
+            except Exception as e:
+                print(f"Error ingesting {job.filename}: {e}")  # Debugging: Log the error
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                job.finished_at = datetime.now(timezone.utc)
+                self._queue.task_done()
+
+    async def _ingest(self, job: IngestJob, loop: asyncio.AbstractEventLoop):
+        job.status = "hashing"
+        source = str(Path(job.file_path).resolve())
+        file_hash = await asyncio.to_thread(hash_file, job.file_path)
+        collection = await asyncio.to_thread(get_sourcebook_collection, job.campaign_id)
+
+        # Content that is already indexed is not extracted or embedded again
+        job.skipped = await asyncio.to_thread(check_indexed, collection, source, file_hash)
+        if not job.skipped:
+            # Chunks go through a spool file so neither process holds the whole book
+            job.status = "extracting"
+            spool_path = f"{job.file_path}.chunks.jsonl"
+            try:
+                with span("extract"):
+                    job.total_chunks = await loop.run_in_executor(
+                        self._executor, spool_chunks, job.file_path, spool_path
+                    )
+
+                job.status = "embedding"
+                await asyncio.to_thread(
+                    index_chunks, collection, source, job.filename, file_hash, read_spool(spool_path),
+                    job.labels, INGEST_BATCH_SIZE, self._progress_callback(job)
+                )
+            finally:
+                if os.path.exists(spool_path):
+                    os.remove(spool_path)
@@ -0,0 +1,162 @@
+import os
+import re
+import json
+import math
+import threading
+from collections import Counter, defaultdict
+from pathlib import Path
+
+# Where the per-collection inverted indexes are kept
+LEXICAL_DIR = os.getenv("LEXICAL_DIR", os.path.join("chroma_data", "lexical"))
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Reciprocal rank fusion constant
+RRF_K = 60
+
+# Keeps numbers and hyphenated/apostrophised words so "CR 5" and "half-orc" survive
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or that the "
+    "their them then there these they this to was were will with".split()
+)
+
+# Chunk labels kept in the index so filters apply without asking ChromaDB
+FILTER_LABELS = ("book", "type")
+
+
+def tokenize(text: str) -> list:
+    """
+    Lower-case and split text into index terms, dropping common stopwords.
+    """
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over one ChromaDB collection's chunks, persisted as JSON.
+
+    Only term frequencies and filter labels are stored; documents are read back from
+    ChromaDB by id, which needs no embedding.
+    """
+
+    def __init__(self, collection_name: str, directory: str = LEXICAL_DIR):
+        self.path = Path(directory) / f"{collection_name}.json"
+        self._lock = threading.Lock()
+        self._docs = {}
+        self._postings = defaultdict(set)
+        self._total_length = 0
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for doc_id, doc in json.load(f)["docs"].items():
+                    self._insert(doc_id, doc)
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _insert(self, doc_id: str, doc: dict):
+        self._docs[doc_id] = doc
+        self._total_length += doc["length"]
+        for term in doc["tf"]:
+            self._postings[term].add(doc_id)
+
+    def _delete(self, doc_id: str):
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+        self._total_length -= doc["length"]
+        for term in doc["tf"]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.discard(doc_id)
+                if not postings:
+                    del self._postings[term]
+
+    def add(self, ids: list, documents: list, metadatas: list):
+        """
+        Index (or re-index) chunks.
+        """
+        with self._lock:
+            for doc_id, text, metadata in zip(ids, documents, metadatas):
+                self._delete(doc_id)
+                terms = tokenize(text)
+                self._insert(doc_id, {
+                    "tf": dict(Counter(terms)),
+                    "length": len(terms),
+                    "labels": {label: metadata.get(label) for label in FILTER_LABELS},
+                })
+
+    def update_labels(self, ids: list, metadatas: list):
+        with self._lock:
+            for doc_id, metadata in zip(ids, metadatas):
+                if doc_id in self._docs:
+                    self._docs[doc_id]["labels"] = {label: metadata.get(label) for label in FILTER_LABELS}
+
+    def remove(self, ids: list):
+        with self._lock:
+            for doc_id in ids:
+                self._delete(doc_id)
+
+    def save(self):
+        # Write to a temporary file first so a crash never leaves a torn index
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"docs": self._docs}, f)
+            os.replace(tmp_path, self.path)
+
+    def search(self, query: str, n_results: int, book: str = None, doc_type: str = None) -> list:
+        """
+        Rank chunks against a query with BM25.
+
+        Args:
+            query (str): The search query.
+            n_results (int): Maximum number of results.
+            book (str, optional): Only return chunks from this book.
+            doc_type (str, optional): Only return chunks of this type.
+
+        Returns:
+            list: (chunk id, score) pairs, best first.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            if not terms or not self._docs:
+                return []
+            doc_count = len(self._docs)
+            average_length = self._total_length / doc_count or 1.0
+            scores = defaultdict(float)
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id in postings:
+                    doc = self._docs[doc_id]
+                    labels = doc["labels"]
+                    if (book and labels.get("book") != book) or (doc_type and labels.get("type") != doc_type):
+                        continue
+                    tf = doc["tf"][term]
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc["length"] / average_length)
+                    scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = RRF_K) -> list:
+    """
+    Fuse several ranked id lists into one with reciprocal rank fusion.
+
+    Args:
+        rankings (list): Lists of ids, best first.
+        k (int): Damping constant; larger values flatten the contribution of top ranks.
+
+    Returns:
+        list: (id, fused score) pairs, best first.
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -2,33 +2,121 @@
 
 import sys
 import os
+import json
+import asyncio
+import shutil
+import uuid
+import httpx
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List, Literal, Optional
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # Create the main application file
-from fastapi import FastAPI, Depends, HTTPException, Request, File, UploadFile
+from fastapi import (
+    APIRouter, FastAPI, BackgroundTasks, Depends, HTTPException, Query, Request, File, UploadFile,
+    WebSocket, WebSocketDisconnect
+)
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import get_db
-from utils import (
+from backend.config import configure_logging, load_ollama_api_key
+from backend.database import async_session_maker, engine, get_db
+from backend.metrics import metrics, TimingMiddleware
+from backend.broadcast import narration_broadcaster, narration_event, SubscriberOverflowError
+from backend.utils import (
     create_campaign, get_campaigns, get_campaign_by_id,
-    create_narration_log, get_narration_logs,
-    create_session, get_sessions, query_ollama, retrieve_from_chromadb
+    create_narration_log, get_narration_logs, get_narration_logs_after, search_narration_logs,
+    create_session, get_sessions, get_session_conversation, save_session_conversation,
+    close_session, get_session_story,
+    retrieve_from_chromadb, retrieve_batch_from_chromadb,
+    close_ollama_client, retrieval_cache, response_cache, get_embedding_cache, llm_scheduler, DEFAULT_MODEL,
+    BackendUnavailableError, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE,
+    warm_start_vector_store, vector_store_status
+)
+from backend.jobs import IngestQueue, staging_path
+from backend.game_log import GameLogWriter
+from backend.extraction import SUPPORTED_EXTENSIONS
+from backend.context import build_narration_context, refresh_rolling_summary, CONTEXT_TOKEN_BUDGET
+from backend.narrate import (
+    gather_narration_inputs, build_narration_prompt, passage_sources, select_passages,
+    build_session_system_prompt, build_session_turn, trim_session_history, session_lock, NARRATE_PASSAGES,
+    NARRATE_CANDIDATES
 )
-from pydantic import BaseModel
-import PyPDF2
-import chromadb
-from chromadb.config import Settings
+from pydantic import BaseModel, Field
+
+# Size of the pieces uploads are copied to disk in
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Most queries accepted by one /retrieve/batch call
+RETRIEVE_BATCH_MAX = int(os.getenv("RETRIEVE_BATCH_MAX", "50"))
+
+# Background queue for sourcebook ingestion
+ingest_queue = IngestQueue()
+# Background summarization of closed sessions into game logs
+game_log_writer = GameLogWriter()
 
-# Initialize ChromaDB client
-chroma_client = chromadb.Client(Settings(persist_directory="chroma_data"))
+# Point-in-time values read when /metrics is scraped
+metrics.gauge("llm_in_flight", "Generations running on Ollama backends.", lambda: llm_scheduler.in_flight)
+metrics.gauge("llm_queue_depth", "Generations waiting for a free Ollama slot.", lambda: llm_scheduler.queue_depth)
+metrics.gauge("narration_subscribers", "Players connected to narration feeds.",
+              lambda: narration_broadcaster.stats()["subscribers"])
+metrics.gauge("retrieval_cache_entries", "Entries in the retrieval cache.", lambda: retrieval_cache.stats()["size"])
 
-app = FastAPI()
+router = APIRouter()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start the app's background resources and release them on shutdown.
+    """
+    configure_logging()
+    ingest_queue.start()
+    llm_scheduler.start_health_checks()
+    # The API answers immediately; /ready reports when retrieval is hot
+    app.state.warm_start = asyncio.create_task(asyncio.to_thread(warm_start_vector_store))
+    try:
+        yield
+    finally:
+        # Stop ingestion workers and health checks, then release pooled connections
+        await ingest_queue.stop()
+        await game_log_writer.stop()
+        await llm_scheduler.stop_health_checks()
+        await close_ollama_client()
+        await engine.dispose()
 
 class LLMQuery(BaseModel):
     prompt: str
+    model: str = DEFAULT_MODEL
+    campaign_id: Optional[int] = None
+    # Opt in to answering from the response cache
+    cache: bool = False
+    # DM narration is scheduled ahead of player side-questions
+    priority: Literal["dm", "player", "background"] = "player"
+
+class RetrievalQuery(BaseModel):
+    query: str
+    # Name of this query's entry in the response; defaults to the query text
+    key: Optional[str] = None
+    n_results: int = Field(5, ge=1, le=100)
+    book: Optional[str] = None
+    doc_type: Optional[str] = None
+    mode: Literal["vector", "hybrid", "lexical"] = "vector"
+
+class BatchRetrieveRequest(BaseModel):
+    queries: List[RetrievalQuery]
+    campaign_id: Optional[int] = None
+
+class NarrateRequest(BaseModel):
+    prompt: str
+    model: str = DEFAULT_MODEL
+    # Optional filters on the sourcebook passages used as lore
+    book: Optional[str] = None
+    doc_type: Optional[str] = None
+    # At most the number of candidates retrieved, and at least one passage
+    passages: int = Field(NARRATE_PASSAGES, ge=1, le=NARRATE_CANDIDATES)
+    history_budget: Optional[int] = None
 
-@app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
     """
     Custom exception handler to log validation errors.
@@ -39,124 +127,611 @@ async def validation_exception_handler(request, exc):
         content={"error": str(exc)}
     )
 
-@app.get("/")
+@router.get("/")
 def read_root():
     return {"message": "Welcome to the Dungeon Master Assistant API!"}
 
-@app.post("/campaigns/")
+@router.get("/ready")
+def readiness():
+    """
+    Endpoint to report whether the vector store has been loaded and warmed.
+
+    Returns:
+        JSONResponse: The warm-up status, with HTTP 200 once ready and 503 before.
+    """
+    status_code = 200 if vector_store_status["status"] == "ready" else 503
+    return JSONResponse(status_code=status_code, content=vector_store_status)
+
+@router.post("/campaigns/")
 async def create_new_campaign(name: str, description: str = None, db: AsyncSession = Depends(get_db)):
     return await create_campaign(db, name, description)
 
-@app.get("/campaigns/")
+@router.get("/campaigns/")
 async def list_campaigns(db: AsyncSession = Depends(get_db)):
     return await get_campaigns(db)
 
-@app.get("/campaigns/{campaign_id}")
+@router.get("/campaigns/{campaign_id}")
 async def get_campaign(campaign_id: int, db: AsyncSession = Depends(get_db)):
     campaign = await get_campaign_by_id(db, campaign_id)
     if not campaign:
         raise HTTPException(status_code=404, detail="Campaign not found")
     return campaign
 
-@app.post("/campaigns/{campaign_id}/narration_logs/")
-async def add_narration_log(campaign_id: int, content: str, db: AsyncSession = Depends(get_db)):
-    return await create_narration_log(db, campaign_id, content)
+@router.post("/campaigns/{campaign_id}/narration_logs/")
+async def add_narration_log(campaign_id: int, content: str, background_tasks: BackgroundTasks,
+                            recipients: Optional[List[str]] = Query(None),
+                            db: AsyncSession = Depends(get_db)):
+    """
+    Endpoint to record accepted narration and push it to the campaign's connected players.
+
+    Args:
+        campaign_id (int): The campaign.
+        content (str): The narration text.
+        recipients (List[str], optional): Players to send it to; omit for every player.
+    """
+    log = await create_narration_log(db, campaign_id, content, recipients)
+    # Fold narration that left the recent window into the rolling summary
+    background_tasks.add_task(refresh_rolling_summary, campaign_id)
+    return log
+
+async def _narration_backlog(campaign_id: int, last_id: Optional[int]) -> list:
+    # Narration a reconnecting player missed, read in a short-lived session
+    if last_id is None:
+        return []
+    backlog = []
+    async with async_session_maker() as db:
+        # Pages are capped, so keep reading until the player is caught up
+        while True:
+            logs = await get_narration_logs_after(db, campaign_id, last_id)
+            if not logs:
+                break
+            backlog.extend(narration_event(log) for log in logs)
+            last_id = logs[-1].id
+    return backlog
+
+@router.websocket("/campaigns/{campaign_id}/narration/ws")
+async def narration_socket(websocket: WebSocket, campaign_id: int, player: Optional[str] = None,
+                           last_id: Optional[int] = None):
+    """
+    WebSocket feed of a campaign's accepted narration.
+
+    Args:
+        campaign_id (int): The campaign.
+        player (str, optional): The player's name; narration addressed to other
+            players is not sent. Omit it to receive only narration sent to everyone.
+        last_id (int, optional): Id of the last narration received, to resume after
+            a disconnect; missed narration is sent first.
+    """
+    await websocket.accept()
+    subscription = narration_broadcaster.subscribe(campaign_id, player)
+
+    async def send_events():
+        backlog = await _narration_backlog(campaign_id, last_id)
+        async for event in subscription.events(backlog):
+            await websocket.send_json(event)
+
+    async def receive_until_disconnect():
+        # Clients send nothing, but reading is how a disconnect on a quiet campaign is noticed
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    tasks = [asyncio.create_task(send_events()), asyncio.create_task(receive_until_disconnect())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    except SubscriberOverflowError as e:
+        # The client reconnects with its last id and catches up from the database
+        await websocket.close(code=1013, reason=str(e))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        narration_broadcaster.unsubscribe(subscription)
+
+@router.get("/campaigns/{campaign_id}/narration/stream")
+async def narration_stream(campaign_id: int, request: Request, player: Optional[str] = None,
+                           last_id: Optional[int] = None):
+    """
+    Server-sent events feed of a campaign's accepted narration, for clients without
+    WebSockets. Browsers resume automatically through the Last-Event-ID header.
+
+    Args:
+        campaign_id (int): The campaign.
+        player (str, optional): The player's name, as for the WebSocket feed.
+        last_id (int, optional): Id of the last narration received.
+    """
+    header_id = request.headers.get("last-event-id")
+    if header_id and header_id.isdigit():
+        last_id = int(header_id)
+    subscription = narration_broadcaster.subscribe(campaign_id, player)
+
+    async def stream():
+        try:
+            backlog = await _narration_backlog(campaign_id, last_id)
+            async for event in subscription.events(backlog):
+                yield f"id: {event['id']}\nevent: narration\ndata: {json.dumps(event)}\n\n"
+        except SubscriberOverflowError:
+            # Ending the stream makes the browser reconnect with Last-Event-ID
+            pass
+        finally:
+            narration_broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+@router.get("/narration/broadcast")
+def narration_broadcast_stats():
+    """
+    Endpoint to report connected narration subscribers and delivery counters.
+    """
+    return narration_broadcaster.stats()
+
+@router.get("/campaigns/{campaign_id}/context")
+async def get_narration_context(campaign_id: int, token_budget: int = Query(CONTEXT_TOKEN_BUDGET, ge=1),
+                                db: AsyncSession = Depends(get_db)):
+    """
+    Endpoint to preview the narration context a prompt for this campaign would carry.
+
+    Args:
+        campaign_id (int): The campaign.
+        token_budget (int): Maximum estimated tokens of context.
+
+    Returns:
+        dict: The rolling summary, the recent narration kept verbatim and the packed text.
+    """
+    return await build_narration_context(db, campaign_id, token_budget)
+
+@router.get("/campaigns/{campaign_id}/narration_logs/search")
+async def search_narration_history(campaign_id: int, q: str = Query(..., min_length=1),
+                                   limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                                   offset: int = Query(0, ge=0),
+                                   order: Literal["rank", "recent"] = "rank",
+                                   db: AsyncSession = Depends(get_db)):
+    """
+    Endpoint to search a campaign's narration history, e.g. "when did the party
+    last meet the lich".
+
+    Args:
+        campaign_id (int): The campaign to search.
+        q (str): Search text; supports "quoted phrases", OR and -excluded words.
+        limit (int): Maximum results per page.
+        offset (int): next_offset from the previous page.
+        order (str): "rank" for best matches first or "recent" for newest first.
 
-@app.get("/campaigns/{campaign_id}/narration_logs/")
-async def list_narration_logs(campaign_id: int, db: AsyncSession = Depends(get_db)):
-    return await get_narration_logs(db, campaign_id)
+    Returns:
+        dict: Matching logs with rank and highlighted excerpts, and "next_offset".
+    """
+    return await search_narration_logs(db, campaign_id, q, limit, offset, order)
+
+@router.get("/campaigns/{campaign_id}/narration_logs/")
+async def list_narration_logs(campaign_id: int, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                              cursor: Optional[str] = None, since: Optional[datetime] = None,
+                              before: Optional[datetime] = None, db: AsyncSession = Depends(get_db)):
+    """
+    Endpoint to list a campaign's narration logs, newest first, one page at a time.
+
+    Args:
+        campaign_id (int): The campaign to list.
+        limit (int): Maximum logs per page.
+        cursor (Optional[str]): The next_cursor of the previous page.
+        since (Optional[datetime]): Only logs created at or after this time.
+        before (Optional[datetime]): Only logs created before this time.
+
+    Returns:
+        dict: "items" and "next_cursor" (None on the last page).
+    """
+    try:
+        return await get_narration_logs(db, campaign_id, limit, cursor, since, before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/campaigns/{campaign_id}/sessions/")
+@router.post("/campaigns/{campaign_id}/sessions/")
 async def start_new_session(campaign_id: int, db: AsyncSession = Depends(get_db)):
     return await create_session(db, campaign_id)
 
-@app.get("/campaigns/{campaign_id}/sessions/")
-async def list_sessions(campaign_id: int, db: AsyncSession = Depends(get_db)):
-    return await get_sessions(db, campaign_id)
+@router.get("/campaigns/{campaign_id}/sessions/")
+async def list_sessions(campaign_id: int, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                        cursor: Optional[str] = None, since: Optional[datetime] = None,
+                        before: Optional[datetime] = None, db: AsyncSession = Depends(get_db)):
+    """
+    Endpoint to list a campaign's sessions, most recently started first, one page at a time.
+
+    Args:
+        campaign_id (int): The campaign to list.
+        limit (int): Maximum sessions per page.
+        cursor (Optional[str]): The next_cursor of the previous page.
+        since (Optional[datetime]): Only sessions started at or after this time.
+        before (Optional[datetime]): Only sessions started before this time.
+
+    Returns:
+        dict: "items" and "next_cursor" (None on the last page).
+    """
+    try:
+        return await get_sessions(db, campaign_id, limit, cursor, since, before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/campaigns/{campaign_id}/narrate")
+async def narrate(campaign_id: int, request: NarrateRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Endpoint to generate narration grounded in sourcebook lore and campaign history.
+
+    Retrieval and the narration history query run concurrently, the passages are
+    de-duplicated and diversified, and the generation is streamed back.
+
+    Args:
+        campaign_id (int): The campaign to narrate for.
+        request (NarrateRequest): The DM's prompt plus optional lore filters.
+
+    Returns:
+        StreamingResponse: Newline-delimited JSON: {"sources": [...]} first, then
+        {"content": ...} per token, then {"done": true} or {"error": ...}.
+    """
+    passages, context = await gather_narration_inputs(
+        db, campaign_id, request.prompt, request.book, request.doc_type,
+        request.passages, history_budget=request.history_budget
+    )
+    prompt = build_narration_prompt(request.prompt, passages, context)
+    api_key = load_ollama_api_key()
+
+    async def generate():
+        yield json.dumps({"sources": passage_sources(passages)}) + "\n"
+        try:
+            async for token in llm_scheduler.stream(prompt, request.model, "dm", api_key=api_key):
+                yield json.dumps({"content": token}) + "\n"
+            yield json.dumps({"done": True}) + "\n"
+        except (httpx.HTTPError, BackendUnavailableError) as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@router.post("/campaigns/{campaign_id}/sessions/{session_id}/close", status_code=202)
+async def close_game_session(campaign_id: int, session_id: int, model: str = DEFAULT_MODEL,
+                             db: AsyncSession = Depends(get_db)):
+    """
+    Endpoint to end a session and write its game log in the background.
+
+    The session's narration is summarized in token-bounded windows concurrently,
+    then the summaries are reduced into a short story stored on the session; poll
+    /campaigns/{campaign_id}/sessions/{session_id}/game_log for progress. Closing
+    a closed session again rewrites its game log.
+
+    Args:
+        campaign_id (int): The campaign.
+        session_id (int): The session to close.
+        model (str): The model to summarize with.
+
+    Returns:
+        dict: The session's end time and the summarization job's status.
+    """
+    session = await close_session(db, campaign_id, session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    job = game_log_writer.submit(campaign_id, session_id, model)
+    return {"session_id": session_id, "end_time": session.end_time, "job": job.to_dict()}
+
+@router.get("/campaigns/{campaign_id}/sessions/{session_id}/game_log")
+async def get_game_log(campaign_id: int, session_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    Endpoint to report a session's game log and the progress of its summarization.
+
+    Returns:
+        dict: The session's end time, its "story" (None until written, or if the
+        session had no narration) and the latest summarization "job", if any.
+    """
+    session = await get_session_story(db, campaign_id, session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    job = game_log_writer.get_for_session(session_id)
+    return {
+        "session_id": session_id,
+        "end_time": session.end_time,
+        "story": session.story,
+        "job": job.to_dict() if job else None,
+    }
+
+@router.post("/campaigns/{campaign_id}/sessions/{session_id}/narrate")
+async def narrate_in_session(campaign_id: int, session_id: int, request: NarrateRequest,
+                             db: AsyncSession = Depends(get_db)):
+    """
+    Endpoint to generate narration as the next turn of a session's conversation.
+
+    The session's first request fixes a system message with the campaign context;
+    every later request resends it and the earlier turns unchanged and appends the
+    new turn (this turn's lore plus the DM's prompt). Ollama then reuses the
+    evaluated prefix instead of processing the whole context again, keep_alive keeps
+    the model loaded between turns, and the scheduler routes the session back to the
+    same backend. Requests in one session run one at a time.
+
+    Args:
+        campaign_id (int): The campaign.
+        session_id (int): An open session of the campaign.
+        request (NarrateRequest): The DM's prompt plus optional lore filters;
+            history_budget only applies when the session's context is first built.
 
-@app.post("/llm/query/")
+    Returns:
+        StreamingResponse: Newline-delimited JSON: {"sources": [...]} first, then
+        {"content": ...} per token, then {"done": true, "turns": ...} or {"error": ...}.
+    """
+    session, passages = await asyncio.gather(
+        get_session_conversation(db, campaign_id, session_id),
+        select_passages(request.prompt, campaign_id, request.book, request.doc_type, request.passages)
+    )
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if session.end_time is not None:
+        raise HTTPException(status_code=409, detail="Session has ended")
+    turn = build_session_turn(request.prompt, passages)
+    api_key = load_ollama_api_key()
+
+    async def generate():
+        yield json.dumps({"sources": passage_sources(passages)}) + "\n"
+        async with session_lock(session_id), async_session_maker() as session_db:
+            # Re-read under the lock: an earlier request may have just added its turn
+            current = await get_session_conversation(session_db, campaign_id, session_id)
+            system_prompt = current.system_prompt
+            if system_prompt is None:
+                context_kwargs = {"token_budget": request.history_budget} if request.history_budget else {}
+                system_prompt = build_session_system_prompt(
+                    await build_narration_context(session_db, campaign_id, **context_kwargs)
+                )
+            history = trim_session_history(current.messages or [])
+            messages = [{"role": "system", "content": system_prompt}] + history
+
+            tokens = []
+            try:
+                async for token in llm_scheduler.stream(turn, request.model, "dm", affinity=f"session:{session_id}",
+                                                        api_key=api_key, messages=messages):
+                    tokens.append(token)
+                    yield json.dumps({"content": token}) + "\n"
+            except (httpx.HTTPError, BackendUnavailableError) as e:
+                yield json.dumps({"error": str(e)}) + "\n"
+                return
+
+            # The turn is stored without its lore so history grows slowly; the next
+            # request shares the prefix up to this turn and re-evaluates only this exchange
+            history = history + [
+                {"role": "user", "content": request.prompt},
+                {"role": "assistant", "content": "".join(tokens)},
+            ]
+            await save_session_conversation(session_db, session_id, system_prompt, history)
+        yield json.dumps({"done": True, "turns": len(history) // 2}) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@router.post("/llm/query/")
 async def query_llm(query: LLMQuery):
     """
     Endpoint to query the Ollama Llama API.
 
     Args:
-        query (LLMQuery): The input query containing the prompt for the LLM.
+        query (LLMQuery): The input query containing the prompt for the LLM. With
+            cache set, a cached answer to the same or a near-identical prompt in the
+            same campaign and model is returned instead of generating one.
 
     Returns:
         dict: The response from the LLM API.
     """
-    # Debugging: Log the parsed query
-    print(f"Parsed query: {query}")
+    if query.cache:
+        cached = await run_in_threadpool(response_cache.lookup, query.prompt, query.campaign_id, query.model)
+        if cached:
+            return {"response": cached["response"], "cached": cached["match"]}
 
-    # Load the API key from the Ollama config.json file
-    import json
-    config_path = r"c:\Users\dougl\AppData\Local\Ollama\config.json"
-    with open(config_path, "r") as config_file:
-        config = json.load(config_file)
-    api_key = config.get("id")  # Use the `id` field as the API key
+    api_key = load_ollama_api_key()
 
-    # Prepare the query payload
-    query_payload = {"model": "llama3.2", "prompt": query.prompt}
-    print(f"Query payload: {query_payload}")  # Debugging: Log the query payload
+    # Send the query to the Ollama API through the scheduler without blocking the event loop
+    try:
+        response = {"response": await llm_scheduler.generate(
+            query.prompt, query.model, query.priority, api_key=api_key
+        )}
+    except (httpx.HTTPError, BackendUnavailableError) as e:
+        response = {"error": str(e)}
 
-    # Send the query to the Ollama API
-    response = query_ollama(query.prompt, api_key=api_key)
-
-    # Debugging: Log the full response
-    print(f"Full response from Ollama API: {response}")
+    if query.cache and "response" in response:
+        await run_in_threadpool(response_cache.store, query.prompt, query.campaign_id, query.model, response["response"])
 
     return response
 
-@app.post("/upload/")
-async def upload_sourcebook(file: UploadFile = File(...)):
+@router.post("/llm/stream/")
+async def stream_llm(query: LLMQuery):
+    """
+    Endpoint to stream a reply from the Ollama Llama API as it is generated.
+
+    Args:
+        query (LLMQuery): The input query containing the prompt for the LLM; see
+            /llm/query/ for the cache option.
+
+    Returns:
+        StreamingResponse: Newline-delimited JSON, one {"content": ...} object per
+        token, followed by {"done": true} or {"error": ...}.
+    """
+    cached = None
+    if query.cache:
+        cached = await run_in_threadpool(response_cache.lookup, query.prompt, query.campaign_id, query.model)
+    api_key = None if cached else load_ollama_api_key()
+
+    async def generate():
+        if cached:
+            yield json.dumps({"content": cached["response"]}) + "\n"
+            yield json.dumps({"done": True, "cached": cached["match"]}) + "\n"
+            return
+        tokens = []
+        try:
+            async for token in llm_scheduler.stream(query.prompt, query.model, query.priority, api_key=api_key):
+                tokens.append(token)
+                yield json.dumps({"content": token}) + "\n"
+            yield json.dumps({"done": True}) + "\n"
+        except (httpx.HTTPError, BackendUnavailableError) as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+            return
+        if query.cache:
+            await run_in_threadpool(response_cache.store, query.prompt, query.campaign_id, query.model, "".join(tokens))
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@router.post("/upload/", status_code=202)
+async def upload_sourcebook(file: UploadFile = File(...), campaign_id: Optional[int] = None,
+                            book: str = None, doc_type: str = None):
     """
     Endpoint to upload D&D sourcebooks for retrieval.
 
+    The upload is copied to disk in chunks and queued for background ingestion;
+    poll /ingest/jobs/{job_id} for progress.
+
     Args:
-        file (UploadFile): The uploaded file (PDF or text).
+        file (UploadFile): The uploaded file (PDF, DOCX or text).
+        campaign_id (Optional[int]): Campaign the material belongs to; omit it for
+            core rules shared by every campaign.
+        book (str, optional): Book label used for filtering; defaults to the file name.
+        doc_type (str, optional): Type label used for filtering, e.g. "rules".
 
     Returns:
-        dict: A message indicating success or failure.
+        dict: The ingestion job id and status.
+
+    Raises:
+        HTTPException: 400 if the file type is not supported.
     """
     # Validate file type
-    if not file.filename.endswith(('.pdf', '.txt')):
-        return {"error": "Unsupported file type. Please upload a PDF or text file."}
+    if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+        raise HTTPException(status_code=400, detail="Unsupported file type. Please upload a PDF, DOCX or text file.")
+
+    # Save the uploaded file without holding it all in memory. It is staged under its
+    # job's id, and the job replaces any earlier upload of the same name when it runs.
+    job_id = str(uuid.uuid4())
+    filename = os.path.basename(file.filename)
+    file_path = staging_path(job_id, filename)
 
-    # Save the uploaded file
-    upload_dir = "uploaded_files"
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, file.filename)
+    def save_upload():
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            shutil.copyfileobj(file.file, f, UPLOAD_CHUNK_SIZE)
 
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
+    await run_in_threadpool(save_upload)
 
-    # Extract text from the file
-    extracted_text = ""
-    if file.filename.endswith('.pdf'):
-        with open(file_path, "rb") as pdf_file:
-            reader = PyPDF2.PdfReader(pdf_file)
-            for page in reader.pages:
-                extracted_text += page.extract_text()
-    elif file.filename.endswith('.txt'):
-        with open(file_path, "r", encoding="utf-8") as txt_file:
-            extracted_text = txt_file.read()
+    # Extraction and embedding happen in the background
+    job = ingest_queue.submit(file_path, filename, campaign_id, book, doc_type, job_id)
+    return {"message": "File uploaded and queued for processing.", **job.to_dict()}
 
-    # Store extracted_text in ChromaDB
-    collection = chroma_client.get_or_create_collection(name="dnd_sourcebooks")
-    collection.add(documents=[extracted_text], metadatas=[{"filename": file.filename}])
+@router.get("/ingest/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    """
+    Endpoint to report the status and progress of a sourcebook ingestion job.
 
-    return {"message": "File uploaded and processed successfully."}
+    Args:
+        job_id (str): The id returned by /upload/.
 
-@app.get("/retrieve/")
-def retrieve_content(query: str):
+    Returns:
+        dict: The job status, progress and any error.
+    """
+    job = ingest_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return job.to_dict()
+
+@router.get("/retrieve/")
+def retrieve_content(query: str, campaign_id: Optional[int] = None, book: str = None,
+                     doc_type: str = None, n_results: int = 5,
+                     mode: Literal["vector", "hybrid", "lexical"] = "vector"):
     """
     Endpoint to retrieve content from ChromaDB based on a query.
 
     Args:
         query (str): The search query.
+        campaign_id (Optional[int]): Campaign to search alongside the core rules.
+        book (str, optional): Only return passages from this book.
+        doc_type (str, optional): Only return passages of this type.
+        n_results (int): Maximum number of passages.
+        mode (str): "vector" (embeddings), "hybrid" (embeddings fused with keyword
+            ranking) or "lexical" (keyword ranking only, fastest for exact names).
 
     Returns:
         dict: Retrieved documents and their metadata.
     """
-    results = retrieve_from_chromadb(query)
-    return {"query": query, "results": results}
\ No newline at end of file
+    results = retrieve_from_chromadb(query, campaign_id, book, doc_type, n_results, mode=mode)
+    return {"query": query, "mode": mode, "results": results}
+
+@router.post("/retrieve/batch")
+def retrieve_batch(request: BatchRetrieveRequest):
+    """
+    Endpoint to run several retrieval queries in one round trip.
+
+    All queries are embedded in one call and queries with the same filters share
+    one search per collection, so preparing an encounter (monsters, spells,
+    locations) costs about as much as a single lookup.
+
+    Args:
+        request (BatchRetrieveRequest): The queries, each with its own n_results,
+            book and doc_type filters and mode, and the campaign to search.
+
+    Returns:
+        dict: "results" keyed by each query's key (its text unless given), each
+        holding the query, mode and retrieved documents and metadata.
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="No queries given")
+    if len(request.queries) > RETRIEVE_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {RETRIEVE_BATCH_MAX} queries per batch")
+    keys = [query.key or query.query for query in request.queries]
+    if len(set(keys)) != len(keys):
+        raise HTTPException(status_code=400, detail="Duplicate query keys; give repeated queries distinct keys")
+
+    results = retrieve_batch_from_chromadb(
+        [query.model_dump(exclude={"key"}) for query in request.queries], request.campaign_id
+    )
+    return {"results": {
+        key: {"query": query.query, "mode": query.mode, "results": result}
+        for key, query, result in zip(keys, request.queries, results)
+    }}
+
+@router.get("/retrieve/cache")
+def retrieval_cache_stats():
+    """
+    Endpoint to report retrieval cache size and hit/miss counters.
+    """
+    return retrieval_cache.stats()
+
+@router.get("/embeddings/cache")
+def embedding_cache_stats():
+    """
+    Endpoint to report chunk embedding cache size and hit/miss counters.
+    """
+    return get_embedding_cache().stats()
+
+@router.get("/llm/cache")
+def response_cache_stats():
+    """
+    Endpoint to report LLM response cache size and hit/miss counters.
+    """
+    return response_cache.stats()
+
+@router.get("/llm/scheduler")
+def llm_scheduler_stats():
+    """
+    Endpoint to report LLM scheduler queue depth and wait times, and the health and
+    load of each Ollama backend.
+    """
+    return llm_scheduler.stats()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """
+    Endpoint to expose request, span, database and LLM timing histograms in the
+    Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def create_app() -> FastAPI:
+    """
+    Build the FastAPI application with its routes, error handlers and lifespan.
+    """
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(router)
+    app.add_exception_handler(RequestValidationError, validation_exception_handler)
+    # Per-request timing; clients send "X-Request-Timing: 1" for a Server-Timing header
+    app.add_middleware(TimingMiddleware)
+    return app
+
+app = create_app()
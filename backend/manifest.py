@@ -0,0 +1,100 @@
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional, Union
+
+# Where the per-collection index manifests are kept
+MANIFEST_DIR = os.getenv("MANIFEST_DIR", os.path.join("chroma_data", "manifests"))
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file(path: Union[str, Path]) -> str:
+    """
+    Return the SHA-256 of a file's content, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(source: str, chunk: dict) -> str:
+    """
+    Return a stable ChromaDB id for a chunk.
+
+    The id hashes the source together with the chunk's page, section and text, so
+    an unchanged chunk keeps its id across re-indexing while identical passages in
+    different files never collide.
+    """
+    key = "\0".join([source, str(chunk["page"]), chunk["section"], chunk["text"]])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class IndexManifest:
+    """
+    Record of which files are indexed in a collection, keyed by source path, with
+    the content hash of each file and the ids of the chunks it contributed.
+    """
+
+    def __init__(self, collection_name: str, directory: str = MANIFEST_DIR):
+        self.path = Path(directory) / f"{collection_name}.json"
+        self._lock = threading.Lock()
+        self._files = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._files = json.load(f).get("files", {})
+
+    def get(self, source: str) -> Optional[dict]:
+        with self._lock:
+            return self._files.get(source)
+
+    def find_by_hash(self, file_hash: str, exclude: str = None) -> Optional[str]:
+        """
+        Return another indexed source with the same content hash, if any.
+        """
+        sources = self.find_all_by_hash(file_hash, exclude)
+        return sources[0] if sources else None
+
+    def find_all_by_hash(self, file_hash: str, exclude: str = None) -> list:
+        """
+        Return every other indexed source with the same content hash.
+        """
+        with self._lock:
+            return [source for source, entry in self._files.items()
+                    if source != exclude and entry["file_hash"] == file_hash]
+
+    def sources_under(self, directory: Union[str, Path], recursive: bool = False) -> list:
+        """
+        Return the indexed sources that live directly in a directory, or anywhere
+        below it when recursive is True.
+        """
+        directory = Path(directory).resolve()
+        with self._lock:
+            if recursive:
+                return [source for source in self._files if directory in Path(source).parents]
+            return [source for source in self._files if Path(source).parent == directory]
+
+    def set(self, source: str, file_hash: str, chunk_ids: list):
+        with self._lock:
+            self._files[source] = {"file_hash": file_hash, "chunk_ids": chunk_ids}
+            self._save()
+
+    def remove(self, source: str) -> list:
+        """
+        Forget a source and return the chunk ids it had in the collection.
+        """
+        with self._lock:
+            entry = self._files.pop(source, None)
+            self._save()
+        return entry["chunk_ids"] if entry else []
+
+    def _save(self):
+        # Write to a temporary file first so a crash never leaves a torn manifest
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self._files}, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,297 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+# Send a Server-Timing header on every response, not only to clients that ask with X-Request-Timing
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").strip().lower() in ("1", "true", "yes", "on")
+TIMING_REQUEST_HEADER = b"x-request-timing"
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 40, 60, 80, 100, 150, 200, 300)
+
+# Spans recorded while handling the current request; None outside a request
+_request_timings: ContextVar[Optional[list]] = ContextVar("request_timings", default=None)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    A monotonically increasing count per label set.
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> list:
+        with self._lock:
+            return [(self.name, self.labelnames, key, "", value) for key, value in sorted(self._values.items())]
+
+
+class Gauge:
+    """
+    A value read from a callback when the metrics are scraped.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def samples(self) -> list:
+        return [(self.name, (), (), "", self.read())]
+
+
+class Histogram:
+    """
+    Observations counted into cumulative buckets per label set, Prometheus style.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last is +Inf), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, **labels) -> dict:
+        """
+        Count, sum and mean of one label set, for JSON stats endpoints.
+        """
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                return {"count": 0, "sum": 0.0, "mean": 0.0}
+            return {"count": series[2], "sum": round(series[1], 6), "mean": round(series[1] / series[2], 6)}
+
+    def samples(self) -> list:
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    samples.append((f"{self.name}_bucket", self.labelnames, key,
+                                    f'le="{_format_value(bound)}"', cumulative))
+                samples.append((f"{self.name}_sum", self.labelnames, key, "", total))
+                samples.append((f"{self.name}_count", self.labelnames, key, "", count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    The process's metrics, rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, read: Callable[[], float]) -> Gauge:
+        return self.register(Gauge(name, help, read))
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labelnames, values, extra, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labelnames, values, extra)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Shared by every module in the process
+metrics = MetricsRegistry()
+
+span_seconds = metrics.histogram(
+    "span_duration_seconds", "Time spent in instrumented sections of the request path.", ("span",)
+)
+http_request_seconds = metrics.histogram(
+    "http_request_duration_seconds", "Time to handle an HTTP request, including streamed bodies.",
+    ("method", "route", "status")
+)
+db_query_seconds = metrics.histogram(
+    "db_query_duration_seconds", "Time to execute one SQL statement.", ("statement",)
+)
+llm_queue_wait_seconds = metrics.histogram(
+    "llm_queue_wait_seconds", "Time a generation waited for a free Ollama slot.", ("priority",)
+)
+llm_ttft_seconds = metrics.histogram(
+    "llm_time_to_first_token_seconds", "Time from sending a prompt to Ollama to its first token.", ("model",)
+)
+llm_generation_seconds = metrics.histogram(
+    "llm_generation_duration_seconds", "Time from sending a prompt to Ollama to the end of its reply.", ("model",)
+)
+llm_tokens_per_second = metrics.histogram(
+    "llm_tokens_per_second", "Decode rate of each generation.", ("model",), TOKEN_RATE_BUCKETS
+)
+llm_tokens = metrics.counter("llm_tokens_total", "Tokens generated by Ollama.", ("model",))
+embedded_texts = metrics.counter("embedded_texts_total", "Texts run through the embedding model.")
+
+
+def record_span(name: str, seconds: float):
+    """
+    Record a timed section in the span histogram and in the current request's timings.
+    """
+    span_seconds.observe(seconds, span=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def span(name: str):
+    """
+    Time the enclosed block as a named span. Works in threads and coroutines alike:
+    worker threads started from a request inherit its timings.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+def server_timing(timings: list, total: float) -> str:
+    """
+    Format spans as a Server-Timing header value, summing repeated spans.
+    """
+    durations = {}
+    counts = {}
+    for name, seconds in timings:
+        durations[name] = durations.get(name, 0.0) + seconds
+        counts[name] = counts.get(name, 0) + 1
+    entries = [f'{name};dur={seconds * 1000:.1f};desc="{counts[name]}x"' for name, seconds in durations.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def install_sql_timing(engine):
+    """
+    Time every SQL statement an engine executes as a "db" span.
+
+    Args:
+        engine: A SQLAlchemy Engine (for an AsyncEngine, pass engine.sync_engine).
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["query_started"].pop()
+        db_query_seconds.observe(seconds, statement=statement.lstrip().split(None, 1)[0].upper())
+        record_span("db", seconds)
+
+    @event.listens_for(engine, "handle_error")
+    def _on_error(exception_context):
+        started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+        if started:
+            started.pop()
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware that times every HTTP request and collects its spans.
+
+    Request durations go to http_request_duration_seconds by route template. If the
+    client sends "X-Request-Timing: 1" (or SERVER_TIMING is set), the response
+    carries a Server-Timing header with the spans recorded before the response
+    started; for streamed responses that is everything before the first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        timings = []
+        token = _request_timings.set(timings)
+        wants_header = SERVER_TIMING or dict(scope.get("headers", [])).get(TIMING_REQUEST_HEADER, b"").lower() in (
+            b"1", b"true", b"yes"
+        )
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if wants_header:
+                    header = server_timing(timings, time.perf_counter() - started)
+                    message = {**message, "headers": list(message.get("headers", [])) + [
+                        (b"server-timing", header.encode("latin-1"))
+                    ]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            # The route template keeps one series per endpoint rather than per URL
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_request_seconds.observe(time.perf_counter() - started, method=scope["method"],
+                                         route=route, status=str(status))
@@ -1,9 +1,13 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, func
+from sqlalchemy import Column, Computed, Integer, String, Text, ForeignKey, DateTime, Index, JSON, func
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 
 Base = declarative_base()
 
+# Text search configuration of narration_logs.search_vector; queries must use the same one
+SEARCH_CONFIG = "english"
+
 class Campaign(Base):
     __tablename__ = 'campaigns'
 
@@ -14,6 +18,7 @@ class Campaign(Base):
 
     narration_logs = relationship("NarrationLog", back_populates="campaign")
     sessions = relationship("Session", back_populates="campaign")
+    summary = relationship("CampaignSummary", back_populates="campaign", uselist=False)
 
 class NarrationLog(Base):
     __tablename__ = 'narration_logs'
@@ -21,10 +26,26 @@ class NarrationLog(Base):
     id = Column(Integer, primary_key=True, index=True)
     campaign_id = Column(Integer, ForeignKey('campaigns.id', ondelete='CASCADE'), nullable=False)
     content = Column(Text, nullable=False)
+    # Player names the narration was sent to; None means every player
+    recipients = Column(JSON, nullable=True)
     created_at = Column(DateTime, server_default=func.now())
+    # Maintained by Postgres from content; deferred so listing logs never loads it
+    search_vector = deferred(Column(
+        TSVECTOR,
+        Computed(f"to_tsvector('{SEARCH_CONFIG}', content)", persisted=True)
+    ))
 
     campaign = relationship("Campaign", back_populates="narration_logs")
 
+    __table_args__ = (
+        # Keyset pagination of a campaign's logs, newest first
+        Index("ix_narration_logs_campaign_created", "campaign_id", "created_at", "id"),
+        # Resuming a player's narration feed after the last id it received
+        Index("ix_narration_logs_campaign_id", "campaign_id", "id"),
+        # Full-text search of narration history
+        Index("ix_narration_logs_search", "search_vector", postgresql_using="gin"),
+    )
+
 class Session(Base):
     __tablename__ = 'sessions'
 
@@ -32,5 +53,28 @@ class Session(Base):
     campaign_id = Column(Integer, ForeignKey('campaigns.id', ondelete='CASCADE'), nullable=False)
     start_time = Column(DateTime, server_default=func.now())
     end_time = Column(DateTime, nullable=True)
+    # Instructions plus campaign context, fixed at the session's first narration so
+    # every request in the session starts with the same prompt prefix
+    system_prompt = deferred(Column(Text, nullable=True))
+    # Chat turns sent after the system prompt, [{"role": ..., "content": ...}, ...]
+    messages = deferred(Column(JSON, nullable=False, default=list))
+    # Short-story game log written when the session is closed
+    story = deferred(Column(Text, nullable=True))
+
+    campaign = relationship("Campaign", back_populates="sessions")
+
+    __table_args__ = (
+        # Keyset pagination of a campaign's sessions, most recent first
+        Index("ix_sessions_campaign_start", "campaign_id", "start_time", "id"),
+    )
+
+class CampaignSummary(Base):
+    __tablename__ = 'campaign_summaries'
+
+    campaign_id = Column(Integer, ForeignKey('campaigns.id', ondelete='CASCADE'), primary_key=True)
+    # Rolling summary of every narration log up to and including summarized_through_id
+    summary = Column(Text, nullable=False, default="")
+    summarized_through_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
-    campaign = relationship("Campaign", back_populates="sessions")
\ No newline at end of file
+    campaign = relationship("Campaign", back_populates="summary")
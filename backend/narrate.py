@@ -0,0 +1,250 @@
+import os
+import asyncio
+import hashlib
+import weakref
+from typing import Optional
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from backend.cache import normalize_query
+from backend.context import build_narration_context, estimate_tokens, truncate_to_tokens
+from backend.utils import retrieve_from_chromadb
+
+# Narration pipeline settings
+NARRATE_CANDIDATES = int(os.getenv("NARRATE_CANDIDATES", "20"))
+NARRATE_PASSAGES = int(os.getenv("NARRATE_PASSAGES", "5"))
+NARRATE_LORE_BUDGET = int(os.getenv("NARRATE_LORE_BUDGET", "1500"))
+# Relevance vs. diversity trade-off for maximal marginal relevance (1.0 = relevance only)
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Estimated tokens of chat history kept in a session's conversation
+SESSION_HISTORY_BUDGET = int(os.getenv("SESSION_HISTORY_BUDGET", "4000"))
+
+NARRATE_PROMPT = """You are the narrator for a Dungeons & Dragons campaign. Use the
+source material and the campaign history below to stay consistent with the world and
+the story so far, then respond to the Dungeon Master's request.
+
+Source material:
+{lore}
+
+Campaign history:
+{history}
+
+Dungeon Master's request:
+{prompt}"""
+
+# A session's conversation is [system, earlier turns..., new turn]. The system
+# message holds everything that stays fixed for the session, so Ollama only has to
+# evaluate the new turn; lore changes every turn and goes in the turn itself.
+SESSION_SYSTEM_PROMPT = """You are the narrator for a Dungeons & Dragons campaign. Each
+message from the Dungeon Master contains source material followed by a request. Use
+the source material and the story so far to stay consistent with the world, then
+respond to the request.
+
+Campaign history:
+{history}"""
+
+SESSION_TURN_PROMPT = """Source material:
+{lore}
+
+Dungeon Master's request:
+{prompt}"""
+
+# One lock per session while its conversation is being extended
+_session_locks = weakref.WeakValueDictionary()
+
+
+def deduplicate_passages(results: dict) -> list:
+    """
+    Flatten retrieval results into passages, dropping repeated text.
+
+    Overlapping chunks and the same passage indexed in several collections would
+    otherwise crowd out distinct material.
+
+    Returns:
+        list: Dicts with "id", "text", "metadata", "distance" and "embedding", closest first.
+    """
+    passages, seen = [], set()
+    embeddings = results.get("embeddings", [[None] * len(results["ids"][0])])[0]
+    for id_, text, metadata, distance, embedding in zip(
+        results["ids"][0], results["documents"][0], results["metadatas"][0],
+        results["distances"][0], embeddings
+    ):
+        fingerprint = hashlib.sha1(normalize_query(text).encode("utf-8")).hexdigest()
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        passages.append({"id": id_, "text": text, "metadata": metadata,
+                         "distance": distance, "embedding": embedding})
+    return passages
+
+
+def mmr_select(passages: list, k: int, lambda_: float = MMR_LAMBDA) -> list:
+    """
+    Pick k passages by maximal marginal relevance.
+
+    Each step takes the passage that best balances relevance to the query against
+    similarity to passages already picked, so near-duplicates are skipped in favour
+    of new information.
+
+    Args:
+        passages (list): Passages from deduplicate_passages, with embeddings.
+        k (int): How many passages to pick.
+        lambda_ (float): Weight of relevance against diversity.
+
+    Returns:
+        list: The selected passages in pick order.
+    """
+    if len(passages) <= k or any(passage["embedding"] is None for passage in passages):
+        return passages[:k]
+
+    vectors = np.asarray([passage["embedding"] for passage in passages], dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    similarity = vectors @ vectors.T
+    # ChromaDB's default space is squared L2; on unit vectors that is 2 - 2 * cosine
+    relevance = 1.0 - np.asarray([passage["distance"] for passage in passages], dtype=np.float32) / 2.0
+
+    selected = [int(np.argmax(relevance))]
+    remaining = set(range(len(passages))) - set(selected)
+    while remaining and len(selected) < k:
+        candidates = list(remaining)
+        redundancy = similarity[np.ix_(candidates, selected)].max(axis=1)
+        scores = lambda_ * relevance[candidates] - (1 - lambda_) * redundancy
+        best = candidates[int(np.argmax(scores))]
+        selected.append(best)
+        remaining.remove(best)
+    return [passages[index] for index in selected]
+
+
+def pack_passages(passages: list, token_budget: int) -> list:
+    """
+    Keep passages in order until the token budget is spent.
+    """
+    packed, remaining = [], token_budget
+    for passage in passages:
+        cost = estimate_tokens(passage["text"])
+        if cost > remaining:
+            continue
+        packed.append(passage)
+        remaining -= cost
+    return packed
+
+
+async def select_passages(prompt: str, campaign_id: int, book: str = None, doc_type: str = None,
+                          passages: int = NARRATE_PASSAGES, lore_budget: int = NARRATE_LORE_BUDGET) -> list:
+    """
+    Retrieve, de-duplicate, diversify and pack the lore for a prompt.
+    """
+    results = await asyncio.to_thread(
+        retrieve_from_chromadb, prompt, campaign_id, book, doc_type,
+        NARRATE_CANDIDATES, True, True
+    )
+    selected = mmr_select(deduplicate_passages(results), passages)
+    return pack_passages(selected, lore_budget)
+
+
+async def gather_narration_inputs(db: AsyncSession, campaign_id: int, prompt: str,
+                                  book: str = None, doc_type: str = None,
+                                  passages: int = NARRATE_PASSAGES,
+                                  lore_budget: int = NARRATE_LORE_BUDGET,
+                                  history_budget: Optional[int] = None) -> tuple:
+    """
+    Fetch lore and narration history for a prompt concurrently.
+
+    The ChromaDB lookup runs on a worker thread while the narration context is read
+    from the database, so the wait is the slower of the two rather than their sum.
+
+    Returns:
+        tuple: (selected passages, narration context dict).
+    """
+    context_kwargs = {"token_budget": history_budget} if history_budget else {}
+    selected, context = await asyncio.gather(
+        select_passages(prompt, campaign_id, book, doc_type, passages, lore_budget),
+        build_narration_context(db, campaign_id, **context_kwargs)
+    )
+    return selected, context
+
+
+def format_lore(passages: list) -> str:
+    lore = "\n\n".join(
+        f"[{passage['metadata'].get('book', passage['metadata'].get('filename'))}"
+        f"{', p. ' + str(passage['metadata']['page']) if 'page' in passage['metadata'] else ''}]\n"
+        f"{passage['text']}"
+        for passage in passages
+    )
+    return lore or "(none found)"
+
+
+def build_narration_prompt(prompt: str, passages: list, context: dict) -> str:
+    """
+    Combine the DM's request with the selected lore and the narration context.
+    """
+    return NARRATE_PROMPT.format(
+        lore=format_lore(passages),
+        history=context["text"] or "(the campaign is just beginning)",
+        prompt=prompt,
+    )
+
+
+def build_session_system_prompt(context: dict) -> str:
+    """
+    The fixed system message of a session's conversation, from the narration
+    context when the session started.
+    """
+    return SESSION_SYSTEM_PROMPT.format(history=context["text"] or "(the campaign is just beginning)")
+
+
+def build_session_turn(prompt: str, passages: list) -> str:
+    """
+    The user message for one request in a session: this turn's lore, then the request.
+    """
+    return SESSION_TURN_PROMPT.format(lore=format_lore(passages), prompt=prompt)
+
+
+def trim_session_history(messages: list, token_budget: int = SESSION_HISTORY_BUDGET) -> list:
+    """
+    Drop the oldest turns once a session's history exceeds its token budget.
+
+    Trimming changes the prompt prefix and costs one full prefill, so when the
+    budget is exceeded the history is cut to half of it, leaving room for several
+    more turns before the next trim instead of trimming on every turn.
+
+    Args:
+        messages (list): The session's chat turns, alternating user and assistant.
+        token_budget (int): Maximum estimated tokens of history.
+
+    Returns:
+        list: The turns to keep (the input itself when nothing is dropped).
+    """
+    costs = [estimate_tokens(message["content"]) for message in messages]
+    if sum(costs) <= token_budget:
+        return messages
+    kept, total = 0, 0
+    # Keep whole user/assistant pairs from the newest backwards
+    for start in range(len(messages) - 2, -1, -2):
+        pair = sum(costs[start:start + 2])
+        if total + pair > token_budget // 2:
+            break
+        total += pair
+        kept = len(messages) - start
+    return messages[len(messages) - kept:] if kept else []
+
+
+def session_lock(session_id: int) -> asyncio.Lock:
+    """
+    The lock serializing requests in one session, so turns are appended in order.
+    """
+    lock = _session_locks.get(session_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _session_locks[session_id] = lock
+    return lock
+
+
+def passage_sources(passages: list) -> list:
+    """
+    Describe the passages used, for clients to cite.
+    """
+    return [
+        {"id": passage["id"], "distance": passage["distance"], **passage["metadata"],
+         "excerpt": truncate_to_tokens(passage["text"], 40)}
+        for passage in passages
+    ]
@@ -0,0 +1,248 @@
+import os
+import json
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+import httpx
+from backend.metrics import (
+    record_span, llm_ttft_seconds, llm_generation_seconds, llm_tokens_per_second, llm_tokens
+)
+
+# Ollama server settings
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+DEFAULT_MODEL = "llama3.2"
+
+# How long Ollama keeps a model (and its cached prompt prefix) loaded after a request
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Generations allowed to run at once on one Ollama backend
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+
+# Optional JSON list of backends, one Ollama instance per GPU/host, e.g.
+# [{"url": "http://localhost:11434", "models": ["llama3.2"], "max_concurrency": 2},
+#  {"url": "http://localhost:11435"}]
+OLLAMA_BACKENDS = os.getenv("OLLAMA_BACKENDS")
+
+# Generations can run for minutes, so only the connect timeout is short
+OLLAMA_TIMEOUT = httpx.Timeout(
+    connect=5.0,
+    read=float(os.getenv("OLLAMA_READ_TIMEOUT", "300")),
+    write=30.0,
+    pool=30.0
+)
+OLLAMA_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("OLLAMA_MAX_CONNECTIONS", "20")),
+    max_keepalive_connections=int(os.getenv("OLLAMA_MAX_KEEPALIVE", "10")),
+    keepalive_expiry=60.0
+)
+HEALTH_CHECK_TIMEOUT = 3.0
+
+
+def _model_names(name: str) -> set:
+    # "llama3.2" and "llama3.2:latest" name the same model
+    return {name, f"{name}:latest"} if ":" not in name else {name, name.removesuffix(":latest")}
+
+
+class OllamaBackend:
+    """
+    One Ollama server with its own pooled HTTP client, health state and model list.
+    """
+
+    def __init__(self, url: str, models: list = None, max_concurrency: int = OLLAMA_MAX_CONCURRENCY):
+        self.url = url.rstrip("/")
+        self.models = set(models or [])
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.completed = 0
+        self.failures = 0
+        self.healthy = True
+        self.available_models = set()
+        self.last_checked = None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        The backend's HTTP client, created on first use and shared by every request.
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.url,
+                timeout=OLLAMA_TIMEOUT,
+                limits=OLLAMA_LIMITS
+            )
+        return self._client
+
+    @property
+    def load(self) -> float:
+        return self.in_flight / self.max_concurrency
+
+    def supports(self, model: str) -> bool:
+        """
+        Whether the backend can serve a model. Models reported by the last health
+        check take precedence over the configured list; with neither, any model is
+        assumed to be available.
+        """
+        known = self.available_models or self.models
+        return not known or bool(_model_names(model) & known)
+
+    async def check_health(self) -> bool:
+        """
+        Ping the backend's /api/tags endpoint and refresh its health and model list.
+        """
+        try:
+            response = await self.client.get("/api/tags", timeout=HEALTH_CHECK_TIMEOUT)
+            response.raise_for_status()
+            names = set()
+            for model in response.json().get("models", []):
+                names |= _model_names(model["name"])
+            self.available_models = names
+            self.healthy = True
+        except (httpx.HTTPError, ValueError, KeyError):
+            self.healthy = False
+        self.last_checked = datetime.now(timezone.utc)
+        return self.healthy
+
+    async def stream_chat(self, prompt: str, model: str = DEFAULT_MODEL, api_key: str = None,
+                          messages: list = None, keep_alive: str = OLLAMA_KEEP_ALIVE) -> AsyncIterator[str]:
+        """
+        Stream the reply to a prompt from the backend's /api/chat endpoint token by token.
+
+        Ollama reuses the evaluated state of the longest prefix a request shares
+        with the previous one, so callers holding a conversation should pass the
+        same system message and history each time and only append new turns.
+
+        Args:
+            prompt (str): The input prompt for the LLM, sent as the last user message.
+            model (str): The model to use (default is "llama3.2").
+            api_key (str, optional): The API key for authentication. Defaults to None.
+            messages (list, optional): Earlier chat messages ({"role", "content"}) to send before the prompt.
+            keep_alive (str): How long Ollama keeps the model loaded afterwards, e.g. "30m".
+
+        Yields:
+            str: Pieces of the reply content as Ollama produces them.
+        """
+        headers = {"Content-Type": "application/json"}
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+
+        payload = {
+            "model": model,
+            "messages": list(messages or []) + [
+                {"role": "user", "content": prompt}
+            ],
+            "keep_alive": keep_alive
+        }
+
+        started = time.perf_counter()
+        first_token = None
+        pieces = 0
+        final = None
+        async with self.client.stream("POST", "/api/chat", json=payload, headers=headers) as response:
+            response.raise_for_status()
+            # Ollama streams one JSON object per line
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                try:
+                    chunk_json = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                content = chunk_json.get("message", {}).get("content")
+                if content:
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                        llm_ttft_seconds.observe(first_token, model=model)
+                        record_span("llm_ttft", first_token)
+                    pieces += 1
+                    yield content
+                if chunk_json.get("done"):
+                    final = chunk_json
+                    break
+        self._record_generation(model, time.perf_counter() - started, first_token, pieces, final)
+
+    @staticmethod
+    def _record_generation(model: str, elapsed: float, first_token: Optional[float], pieces: int,
+                           final: Optional[dict]):
+        # Ollama reports exact token counts and decode time on its final message;
+        # otherwise each streamed piece is counted as a token
+        llm_generation_seconds.observe(elapsed, model=model)
+        record_span("llm_generate", elapsed)
+        if final and final.get("eval_count") and final.get("eval_duration"):
+            tokens, decode_seconds = final["eval_count"], final["eval_duration"] / 1e9
+        else:
+            tokens, decode_seconds = pieces, elapsed - (first_token or elapsed)
+        llm_tokens.inc(tokens, model=model)
+        if tokens and decode_seconds > 0:
+            llm_tokens_per_second.observe(tokens / decode_seconds, model=model)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "completed": self.completed,
+            "failures": self.failures,
+            "models": sorted(self.available_models or self.models),
+            "last_checked": self.last_checked.isoformat() if self.last_checked else None,
+        }
+
+
+def load_backends(config: str = OLLAMA_BACKENDS) -> list:
+    """
+    Build the backend pool from OLLAMA_BACKENDS, or a single OLLAMA_URL backend.
+    """
+    if not config:
+        return [OllamaBackend(OLLAMA_URL)]
+    return [
+        OllamaBackend(entry["url"], entry.get("models"), entry.get("max_concurrency", OLLAMA_MAX_CONCURRENCY))
+        for entry in json.loads(config)
+    ]
+
+
+# Shared backend pool; each backend keeps its keep-alive connections between requests
+ollama_backends = load_backends()
+
+
+async def close_ollama_client():
+    """
+    Close every backend's HTTP client and its pooled connections.
+    """
+    for backend in ollama_backends:
+        await backend.close()
+
+
+async def stream_ollama(prompt: str, model: str = DEFAULT_MODEL, api_key: str = None,
+                        backend: OllamaBackend = None, messages: list = None) -> AsyncIterator[str]:
+    """
+    Stream a reply straight from one backend (the first in the pool by default),
+    bypassing the scheduler.
+    """
+    async for token in (backend or ollama_backends[0]).stream_chat(prompt, model, api_key, messages):
+        yield token
+
+
+async def query_ollama(prompt: str, model: str = DEFAULT_MODEL, api_key: str = None) -> dict:
+    """
+    Query the Ollama Llama API with a given prompt using the /chat endpoint.
+
+    Args:
+        prompt (str): The input prompt for the LLM.
+        model (str): The model to use (default is "llama3.2").
+        api_key (str, optional): The API key for authentication. Defaults to None.
+
+    Returns:
+        dict: The combined response from the LLM API.
+    """
+    try:
+        combined_response = "".join([token async for token in stream_ollama(prompt, model, api_key)])
+        return {"response": combined_response}
+    except httpx.HTTPError as e:
+        print(f"Error querying Ollama API: {e}")  # Debugging: Log the error
+        return {"error": str(e)}
@@ -0,0 +1,327 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import itertools
+from collections import OrderedDict, deque
+from typing import AsyncIterator
+import httpx
+from backend.metrics import record_span, llm_queue_wait_seconds
+
+# Seconds between backend health checks
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "15"))
+
+# Lower values are served first
+PRIORITIES = {"dm": 0, "player": 1, "background": 2}
+
+# Conversations remembered for routing back to the backend that holds their prompt cache
+AFFINITY_SIZE = int(os.getenv("OLLAMA_AFFINITY_SIZE", "1024"))
+
+
+class _SharedGeneration:
+    """
+    One running generation whose tokens are replayed to every subscriber, so
+    identical concurrent prompts share a single pass over the GPU.
+    """
+
+    def __init__(self, priority: str):
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        # Highest priority among the subscribers, and the queue entry while waiting for a slot
+        self.priority = priority
+        self.waiter = None
+        self._condition = asyncio.Condition()
+
+    async def push(self, token: str):
+        async with self._condition:
+            self.tokens.append(token)
+            self._condition.notify_all()
+
+    async def finish(self, error: Exception = None):
+        async with self._condition:
+            self.done = True
+            self.error = error
+            self._condition.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        position = 0
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(lambda: len(self.tokens) > position or self.done)
+                new_tokens = self.tokens[position:]
+                done, error = self.done, self.error
+            for token in new_tokens:
+                yield token
+            position += len(new_tokens)
+            if done and position >= len(self.tokens):
+                if error:
+                    raise error
+                return
+
+
+class BackendUnavailableError(Exception):
+    """
+    Raised when no Ollama backend in the pool can serve the requested model.
+    """
+
+
+def _priority_level(priority: str) -> int:
+    return PRIORITIES.get(priority, PRIORITIES["player"])
+
+
+class _Waiter:
+    def __init__(self, priority: str, sequence: int, model: str, exclude: set, preferred=None):
+        self.rank = (_priority_level(priority), sequence)
+        self.model = model
+        self.exclude = exclude
+        self.preferred = preferred
+        self.future = asyncio.get_running_loop().create_future()
+
+
+def _is_backend_failure(error: Exception) -> bool:
+    # Connection failures and 5xx answers (e.g. the model failed to load or ran out
+    # of memory) are the backend's fault; 4xx means the request itself is bad
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+class LLMScheduler:
+    """
+    Admission control and routing in front of a pool of Ollama backends.
+
+    Each backend runs at most max_concurrency generations at once; the rest wait in
+    a priority queue (see PRIORITIES, FIFO within a priority). Requests are routed to
+    the least loaded healthy backend that serves the model, fail over to another
+    backend if a connection fails or the backend answers with a 5xx before any token
+    arrives, and concurrent requests for the same model and prompt are coalesced
+    into one generation (single-flight) that runs at the highest priority among them.
+    Requests with an affinity key (e.g. a session) go back to the backend that served
+    the key last whenever it has a free slot, since only that backend has the
+    conversation's prompt prefix cached.
+    """
+
+    def __init__(self, backends: list, health_interval: float = OLLAMA_HEALTH_INTERVAL):
+        self.backends = backends
+        self.health_interval = health_interval
+        self.completed = 0
+        self.coalesced = 0
+        self.failovers = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._generations = {}
+        self._wait_times = deque(maxlen=512)
+        self._affinity = OrderedDict()
+        self._health_task = None
+
+    @property
+    def in_flight(self) -> int:
+        return sum(backend.in_flight for backend in self.backends)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.future.done())
+
+    def _candidates(self, model: str, exclude: set) -> list:
+        # Unhealthy backends are only tried when no healthy one serves the model
+        compatible = [backend for backend in self.backends
+                      if backend not in exclude and backend.supports(model)]
+        return [backend for backend in compatible if backend.healthy] or compatible
+
+    def _pick(self, model: str, exclude: set, preferred=None):
+        free = [backend for backend in self._candidates(model, exclude)
+                if backend.in_flight < backend.max_concurrency]
+        if preferred in free:
+            return preferred
+        return min(free, key=lambda backend: backend.load) if free else None
+
+    def _dispatch(self):
+        # Hand free slots to waiters in priority order
+        self._waiters = [waiter for waiter in self._waiters if not waiter.future.done()]
+        self._waiters.sort(key=lambda waiter: waiter.rank)
+        for waiter in list(self._waiters):
+            backend = self._pick(waiter.model, waiter.exclude, waiter.preferred)
+            if backend is not None:
+                backend.in_flight += 1
+                waiter.future.set_result(backend)
+                self._waiters.remove(waiter)
+
+    async def _acquire(self, priority: str, model: str, exclude: set, preferred=None,
+                       generation: _SharedGeneration = None):
+        if not self._candidates(model, exclude):
+            raise BackendUnavailableError(f"No Ollama backend available for model '{model}'")
+
+        started = time.monotonic()
+        backend = self._pick(model, exclude, preferred) if not self.queue_depth else None
+        if backend is not None:
+            backend.in_flight += 1
+        else:
+            waiter = _Waiter(priority, next(self._sequence), model, exclude, preferred)
+            self._waiters.append(waiter)
+            if generation is not None:
+                generation.waiter = waiter
+            self._dispatch()
+            try:
+                backend = await waiter.future
+            except asyncio.CancelledError:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    self._release(waiter.future.result())
+                raise
+            finally:
+                if generation is not None:
+                    generation.waiter = None
+        waited = time.monotonic() - started
+        self._wait_times.append(waited)
+        llm_queue_wait_seconds.observe(waited, priority=priority)
+        record_span("llm_queue", waited)
+        return backend
+
+    def _release(self, backend):
+        backend.in_flight -= 1
+        self._dispatch()
+
+    def _remember_affinity(self, affinity: str, backend):
+        self._affinity[affinity] = backend
+        self._affinity.move_to_end(affinity)
+        while len(self._affinity) > AFFINITY_SIZE:
+            self._affinity.popitem(last=False)
+
+    def _raise_priority(self, generation: _SharedGeneration, priority: str):
+        # A coalesced request waits on the shared generation, so the generation must not
+        # queue behind a lower priority than the most urgent of its subscribers
+        if _priority_level(priority) >= _priority_level(generation.priority):
+            return
+        generation.priority = priority
+        waiter = generation.waiter
+        if waiter is not None and not waiter.future.done():
+            waiter.rank = (_priority_level(priority), waiter.rank[1])
+
+    async def _produce(self, key: str, generation: _SharedGeneration, prompt: str, model: str,
+                       kwargs: dict, affinity: str = None):
+        tried = set()
+        try:
+            while True:
+                backend = await self._acquire(generation.priority, model, tried, self._affinity.get(affinity),
+                                              generation)
+                if affinity is not None:
+                    self._remember_affinity(affinity, backend)
+                streamed = False
+                try:
+                    async for token in backend.stream_chat(prompt, model, **kwargs):
+                        streamed = True
+                        await generation.push(token)
+                    backend.completed += 1
+                    self.completed += 1
+                    break
+                except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                    if not _is_backend_failure(e):
+                        raise
+                    backend.failures += 1
+                    backend.healthy = False
+                    # Fail over only while nothing has been sent to the caller
+                    if streamed or not self._candidates(model, tried | {backend}):
+                        raise
+                    tried.add(backend)
+                    self.failovers += 1
+                finally:
+                    self._release(backend)
+            await generation.finish()
+        except asyncio.CancelledError:
+            await generation.finish(RuntimeError("Generation cancelled"))
+            raise
+        except Exception as e:
+            await generation.finish(e)
+        finally:
+            if self._generations.get(key) is generation:
+                del self._generations[key]
+
+    async def stream(self, prompt: str, model: str, priority: str = "player", affinity: str = None,
+                     **kwargs) -> AsyncIterator[str]:
+        """
+        Stream a generation through the scheduler.
+
+        Args:
+            prompt (str): The input prompt for the LLM.
+            model (str): The model to use.
+            priority (str): "dm", "player" or "background".
+            affinity (str, optional): Key of the conversation, routed to the same backend each time.
+            **kwargs: Passed through to OllamaBackend.stream_chat (e.g. api_key, messages).
+
+        Yields:
+            str: Pieces of the reply content as they are generated.
+        """
+        # Only requests with the same model, history and prompt share a generation
+        history = json.dumps(kwargs.get("messages") or [], sort_keys=True)
+        key = hashlib.sha256(f"{model}\0{history}\0{prompt}".encode("utf-8")).hexdigest()
+        generation = self._generations.get(key)
+        if generation is None:
+            generation = _SharedGeneration(priority)
+            self._generations[key] = generation
+            generation.task = asyncio.create_task(
+                self._produce(key, generation, prompt, model, kwargs, affinity)
+            )
+        else:
+            self.coalesced += 1
+            self._raise_priority(generation, priority)
+
+        generation.subscribers += 1
+        try:
+            async for token in generation.subscribe():
+                yield token
+        finally:
+            generation.subscribers -= 1
+            # Nobody is listening any more, so free the GPU for queued requests
+            if generation.subscribers == 0 and not generation.done:
+                if self._generations.get(key) is generation:
+                    del self._generations[key]
+                generation.task.cancel()
+
+    async def generate(self, prompt: str, model: str, priority: str = "player", **kwargs) -> str:
+        """
+        Run a generation through the scheduler and return the full reply.
+        """
+        return "".join([token async for token in self.stream(prompt, model, priority, **kwargs)])
+
+    async def check_health(self):
+        """
+        Health-check every backend concurrently, then let waiters use any that recovered.
+        """
+        await asyncio.gather(*(backend.check_health() for backend in self.backends))
+        self._dispatch()
+
+    async def _health_loop(self):
+        while True:
+            await self.check_health()
+            await asyncio.sleep(self.health_interval)
+
+    def start_health_checks(self):
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop_health_checks(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+
+    def stats(self) -> dict:
+        waits = sorted(self._wait_times)
+
+        def percentile(fraction):
+            return round(waits[min(len(waits) - 1, int(fraction * len(waits)))], 4) if waits else 0.0
+
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "completed": self.completed,
+            "coalesced": self.coalesced,
+            "failovers": self.failovers,
+            "wait_seconds_p50": percentile(0.5),
+            "wait_seconds_p95": percentile(0.95),
+            "wait_seconds_max": round(waits[-1], 4) if waits else 0.0,
+            "backends": [backend.stats() for backend in self.backends],
+        }
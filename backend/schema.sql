@@ -13,7 +13,9 @@ CREATE TABLE narration_logs (
     id SERIAL PRIMARY KEY,
     campaign_id INT NOT NULL,
     content TEXT NOT NULL,
+    recipients JSON, -- player names the narration was sent to; NULL means everyone
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    search_vector TSVECTOR GENERATED ALWAYS AS (to_tsvector('english', content)) STORED,
     FOREIGN KEY (campaign_id) REFERENCES campaigns (id) ON DELETE CASCADE
 );
 
@@ -23,5 +25,44 @@ CREATE TABLE sessions (
     campaign_id INT NOT NULL,
     start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     end_time TIMESTAMP,
+    system_prompt TEXT, -- stable prompt prefix of the session's conversation
+    messages JSON NOT NULL DEFAULT '[]', -- chat turns after the system prompt
+    story TEXT, -- game log written when the session is closed
     FOREIGN KEY (campaign_id) REFERENCES campaigns (id) ON DELETE CASCADE
-);
\ No newline at end of file
+);
+
+-- Table: campaign_summaries (rolling summary of narration older than the recent window)
+CREATE TABLE campaign_summaries (
+    campaign_id INT PRIMARY KEY,
+    summary TEXT NOT NULL DEFAULT '',
+    summarized_through_id INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (campaign_id) REFERENCES campaigns (id) ON DELETE CASCADE
+);
+
+-- Indexes for keyset pagination of campaign history (newest first)
+CREATE INDEX ix_narration_logs_campaign_created ON narration_logs (campaign_id, created_at, id);
+CREATE INDEX ix_sessions_campaign_start ON sessions (campaign_id, start_time, id);
+
+-- Index for resuming a player's narration feed after the last id it received
+CREATE INDEX ix_narration_logs_campaign_id ON narration_logs (campaign_id, id);
+
+-- Index for full-text search of narration history
+CREATE INDEX ix_narration_logs_search ON narration_logs USING GIN (search_vector);
+
+-- Migrations for databases created before these columns and indexes existed
+-- Keyset pagination of campaign history
+-- CREATE INDEX ix_narration_logs_campaign_created ON narration_logs (campaign_id, created_at, id);
+-- CREATE INDEX ix_sessions_campaign_start ON sessions (campaign_id, start_time, id);
+-- Narration recipients and feed resumption
+-- ALTER TABLE narration_logs ADD COLUMN recipients JSON;
+-- CREATE INDEX ix_narration_logs_campaign_id ON narration_logs (campaign_id, id);
+-- Full-text search of narration history
+-- ALTER TABLE narration_logs ADD COLUMN search_vector TSVECTOR
+--     GENERATED ALWAYS AS (to_tsvector('english', content)) STORED;
+-- CREATE INDEX ix_narration_logs_search ON narration_logs USING GIN (search_vector);
+-- Session conversations (system prompt and chat turns)
+-- ALTER TABLE sessions ADD COLUMN system_prompt TEXT;
+-- ALTER TABLE sessions ADD COLUMN messages JSON NOT NULL DEFAULT '[]';
+-- Session game logs
+-- ALTER TABLE sessions ADD COLUMN story TEXT;
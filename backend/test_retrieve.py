@@ -3,12 +3,8 @@ from pathlib import Path
 import PyPDF2
 import docx
 import uuid
-import chromadb
-from chromadb.config import Settings
 from backend.utils import debug_process_and_store_files
-
-# Initialize ChromaDB client
-chroma_client = chromadb.Client(Settings(persist_directory="chroma_data"))
+from backend.vector_store import get_chroma_client
 
 def test_retrieve_endpoint():
     url = "http://127.0.0.1:8000/retrieve/"
@@ -50,7 +46,7 @@ def debug_chromadb_indexing():
     files = path.glob("*.*")
 
     # Initialize ChromaDB collection
-    collection = chroma_client.get_or_create_collection(name="dnd_sourcebooks")
+    collection = get_chroma_client().get_or_create_collection(name="dnd_sourcebooks")
 
     for file in files:
         extracted_text = ""
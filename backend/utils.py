@@ -1,27 +1,59 @@
-import http.client as http_client
-http_client.HTTPConnection.debuglevel = 1
-
-# Enable logging for requests
-import logging
-logging.basicConfig(level=logging.DEBUG)
-logging.getLogger("urllib3").setLevel(logging.DEBUG)
-
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import DateTime, String, func, literal, literal_column, tuple_, update
 from sqlalchemy.future import select
 from sqlalchemy.exc import NoResultFound
-from backend.models import Campaign, NarrationLog, Session
-import httpx
-import json
-from typing import Union
+from sqlalchemy.orm import aliased, undefer
+from backend.models import Campaign, NarrationLog, Session, SEARCH_CONFIG
+from backend.chunking import chunk_metadata
+from backend.extraction import SUPPORTED_EXTENSIONS, extract_chunks, iter_file_chunks, iter_batches
+from backend.ollama_client import DEFAULT_MODEL, ollama_backends, query_ollama, stream_ollama, close_ollama_client
+from backend.manifest import IndexManifest, chunk_id, hash_file
+from backend.scheduler import LLMScheduler, BackendUnavailableError
+from backend.cache import (
+    ResponseCache, retrieval_cache, invalidate_collection, collection_generation, cache_retrieval, normalize_query
+)
+from backend.lexical import LexicalIndex, reciprocal_rank_fusion
+from backend.broadcast import narration_broadcaster, narration_event
+from backend.embeddings import EMBED_BATCH_SIZE, embed_texts, embed_chunks, get_embedding_cache
+from typing import Callable, Iterable, Optional, Union
 from pathlib import Path
-import PyPDF2
-import docx
-import chromadb
-from chromadb.config import Settings
-import uuid
+from datetime import datetime, timezone
+import base64
+import json
+import time
+import threading
+from backend.vector_store import get_chroma_client
+from backend.metrics import span
+
+# Shared core rules collection; each campaign also gets its own collection
+CORE_COLLECTION = "dnd_sourcebooks"
+DEFAULT_DOC_TYPE = "sourcebook"
+
+# Default and maximum page sizes for list endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Readiness of the vector store, filled in by warm_start_vector_store
+vector_store_status = {"status": "cold", "collections": {}, "seconds": None, "error": None}
+
+# Index manifests by collection name
+_manifests = {}
 
-# Initialize ChromaDB client without telemetry
-chroma_client = chromadb.Client(Settings(persist_directory="chroma_data"))
+# BM25 indexes by collection name, kept alongside the ChromaDB collections
+_lexical_indexes = {}
+# Serializes the first load of a manifest or BM25 index, so concurrent requests share one instance
+_index_lock = threading.Lock()
+
+# Retrieval modes: embeddings only, embeddings fused with BM25, or BM25 only (no embedding)
+RETRIEVAL_MODES = ("vector", "hybrid", "lexical")
+# Hybrid mode ranks this many times n_results candidates on each side before fusing
+HYBRID_CANDIDATE_FACTOR = 4
+
+# Opt-in cache of LLM responses, matched exactly or by prompt similarity
+response_cache = ResponseCache(embed_texts)
+
+# Routing, concurrency limits, priorities and single-flight in front of Ollama
+llm_scheduler = LLMScheduler(ollama_backends)
 
 # Utility function to create a new campaign
 async def create_campaign(db: AsyncSession, name: str, description: str = None):
@@ -44,19 +76,84 @@ async def get_campaign_by_id(db: AsyncSession, campaign_id: int):
     except NoResultFound:
         return None
 
-# Utility function to create a new narration log
-async def create_narration_log(db: AsyncSession, campaign_id: int, content: str):
-    new_log = NarrationLog(campaign_id=campaign_id, content=content)
+# Utility function to create a new narration log and push it to the campaign's players
+async def create_narration_log(db: AsyncSession, campaign_id: int, content: str, recipients: list = None):
+    new_log = NarrationLog(campaign_id=campaign_id, content=content, recipients=recipients or None)
     db.add(new_log)
     await db.commit()
-    await db.refresh(new_log)    
+    await db.refresh(new_log)
+    narration_broadcaster.publish(campaign_id, narration_event(new_log))
     return new_log
 
-# Utility function to retrieve narration logs for a campaign
-async def get_narration_logs(db: AsyncSession, campaign_id: int):
-    result = await db.execute(select(NarrationLog).where(NarrationLog.campaign_id == campaign_id))
+# Utility function to retrieve a campaign's narration logs after a given id, oldest first
+async def get_narration_logs_after(db: AsyncSession, campaign_id: int, after_id: int,
+                                   limit: int = MAX_PAGE_SIZE):
+    result = await db.execute(
+        select(NarrationLog)
+        .where(NarrationLog.campaign_id == campaign_id, NarrationLog.id > after_id)
+        .order_by(NarrationLog.id)
+        .limit(limit)
+    )
     return result.scalars().all()
 
+# Utility function to search a campaign's narration logs by full text
+async def search_narration_logs(db: AsyncSession, campaign_id: int, query: str,
+                                limit: int = DEFAULT_PAGE_SIZE, offset: int = 0, order: str = "rank"):
+    """
+    Search a campaign's narration history with Postgres full-text search.
+
+    Matching uses the GIN-indexed search_vector column, and the query accepts web
+    search syntax ("quoted phrases", OR, -excluded). Highlighted excerpts are only
+    built for the rows of the requested page.
+
+    Args:
+        db (AsyncSession): The database session.
+        campaign_id (int): The campaign to search.
+        query (str): The search text.
+        limit (int): Maximum results per page.
+        offset (int): Results to skip (the next_offset of the previous page).
+        order (str): "rank" for best matches first, "recent" for newest first.
+
+    Returns:
+        dict: "items" with id, created_at, rank and highlight, and "next_offset"
+        (None on the last page).
+    """
+    tsquery = func.websearch_to_tsquery(literal_column(f"'{SEARCH_CONFIG}'::regconfig"), query)
+    rank = func.ts_rank_cd(NarrationLog.search_vector, tsquery)
+    ordering = ((rank.desc(), NarrationLog.id.desc()) if order == "rank"
+                else (NarrationLog.created_at.desc(), NarrationLog.id.desc()))
+    # Fetch one extra row to learn whether another page follows
+    page = (
+        select(NarrationLog.id, NarrationLog.content, NarrationLog.created_at, rank.label("rank"))
+        .where(NarrationLog.campaign_id == campaign_id, NarrationLog.search_vector.op("@@")(tsquery))
+        .order_by(*ordering)
+        .offset(offset)
+        .limit(limit + 1)
+        .subquery()
+    )
+    highlight = func.ts_headline(
+        literal_column(f"'{SEARCH_CONFIG}'::regconfig"), page.c.content, tsquery,
+        "StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MinWords=5, MaxWords=25"
+    )
+    page_order = ((page.c.rank.desc(), page.c.id.desc()) if order == "rank"
+                  else (page.c.created_at.desc(), page.c.id.desc()))
+    result = await db.execute(
+        select(page.c.id, page.c.created_at, page.c.rank, highlight.label("highlight")).order_by(*page_order)
+    )
+    rows = result.all()
+
+    next_offset = offset + limit if len(rows) > limit else None
+    items = [
+        {"id": row.id, "created_at": row.created_at, "rank": round(float(row.rank), 4), "highlight": row.highlight}
+        for row in rows[:limit]
+    ]
+    return {"items": items, "next_offset": next_offset}
+
+# Utility function to retrieve a page of narration logs for a campaign, newest first
+async def get_narration_logs(db: AsyncSession, campaign_id: int, limit: int = DEFAULT_PAGE_SIZE,
+                             cursor: str = None, since: datetime = None, before: datetime = None):
+    return await _paginate(db, NarrationLog, NarrationLog.created_at, campaign_id, limit, cursor, since, before)
+
 # Utility function to create a new session
 async def create_session(db: AsyncSession, campaign_id: int):
     new_session = Session(campaign_id=campaign_id)
@@ -65,105 +162,494 @@ async def create_session(db: AsyncSession, campaign_id: int):
     await db.refresh(new_session)
     return new_session
 
-# Utility function to retrieve sessions for a campaign
-async def get_sessions(db: AsyncSession, campaign_id: int):
-    result = await db.execute(select(Session).where(Session.campaign_id == campaign_id))
-    return result.scalars().all()
+# Utility function to retrieve a session with its conversation state
+async def get_session_conversation(db: AsyncSession, campaign_id: int, session_id: int):
+    result = await db.execute(
+        select(Session)
+        .where(Session.id == session_id, Session.campaign_id == campaign_id)
+        .options(undefer(Session.system_prompt), undefer(Session.messages))
+    )
+    return result.scalar_one_or_none()
+
+# Utility function to store a session's system prompt and chat turns
+async def save_session_conversation(db: AsyncSession, session_id: int, system_prompt: str, messages: list):
+    await db.execute(
+        update(Session).where(Session.id == session_id).values(system_prompt=system_prompt, messages=messages)
+    )
+    await db.commit()
+
+# Utility function to end a session (if still open) and return it with its game log
+async def close_session(db: AsyncSession, campaign_id: int, session_id: int):
+    await db.execute(
+        update(Session)
+        .where(Session.id == session_id, Session.campaign_id == campaign_id, Session.end_time.is_(None))
+        .values(end_time=func.now())
+    )
+    await db.commit()
+    return await get_session_story(db, campaign_id, session_id)
+
+# Utility function to retrieve a session with its game log
+async def get_session_story(db: AsyncSession, campaign_id: int, session_id: int):
+    result = await db.execute(
+        select(Session)
+        .where(Session.id == session_id, Session.campaign_id == campaign_id)
+        .options(undefer(Session.story))
+        .execution_options(populate_existing=True)
+    )
+    return result.scalar_one_or_none()
+
+# Utility function to store a session's game log
+async def save_session_story(db: AsyncSession, session_id: int, story: Optional[str]):
+    await db.execute(update(Session).where(Session.id == session_id).values(story=story))
+    await db.commit()
+
+# Utility function to retrieve a page of sessions for a campaign, most recently started first
+async def get_sessions(db: AsyncSession, campaign_id: int, limit: int = DEFAULT_PAGE_SIZE,
+                       cursor: str = None, since: datetime = None, before: datetime = None):
+    return await _paginate(db, Session, Session.start_time, campaign_id, limit, cursor, since, before)
+
+def _as_stored(db: AsyncSession, timestamp: datetime):
+    # A naive timestamp in the columns' own convention, bound so it compares like with like
+    if db.bind.dialect.name == "sqlite":
+        # SQLite keeps timestamps as text, and CURRENT_TIMESTAMP omits fractional seconds
+        return literal(timestamp.isoformat(sep=" "), String)
+    return timestamp
+
+def _db_time(db: AsyncSession, timestamp: datetime):
+    """
+    Express a timestamp filter on the database clock that stamped the rows.
+
+    Rows are stamped by the server default without a time zone: in UTC on SQLite,
+    in the session's time zone on Postgres. Naive timestamps are taken as already
+    in that convention.
+    """
+    if timestamp.tzinfo is None:
+        return _as_stored(db, timestamp)
+    if db.bind.dialect.name == "postgresql":
+        return func.timezone(func.current_setting("TimeZone"), literal(timestamp, DateTime(timezone=True)))
+    return _as_stored(db, timestamp.astimezone(timezone.utc).replace(tzinfo=None))
 
-# Update the query_ollama function to handle streaming responses
-def query_ollama(prompt: str, model: str = "llama3.2", api_key: str = None) -> dict:
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
     """
-    Query the Ollama Llama API with a given prompt using the /chat endpoint.
+    Encode a (timestamp, id) keyset position as an opaque page cursor.
+    """
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{row_id}".encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Decode a page cursor produced by encode_cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+async def _paginate(db: AsyncSession, model, time_column, campaign_id: int, limit: int,
+                    cursor: str = None, since: datetime = None, before: datetime = None) -> dict:
+    """
+    Keyset-paginate a campaign's rows, newest first, on (time_column, id).
+
+    The (campaign_id, time, id) composite indexes make each page an index range
+    scan, so fetching the latest page costs the same however long the campaign runs.
 
     Args:
-        prompt (str): The input prompt for the LLM.
-        model (str): The model to use (default is "llama3.2").
-        api_key (str, optional): The API key for authentication. Defaults to None.
+        db (AsyncSession): The database session.
+        model: The mapped class to page through.
+        time_column: The timestamp column rows are ordered by.
+        campaign_id (int): The campaign to list.
+        limit (int): Maximum rows per page.
+        cursor (str, optional): next_cursor from the previous page.
+        since (datetime, optional): Only rows at or after this time.
+        before (datetime, optional): Only rows strictly before this time.
 
     Returns:
-        dict: The combined response from the LLM API.
-    """
-    url = "http://localhost:11434/api/chat"
-    headers = {"Content-Type": "application/json"}
-    if api_key:
-        headers["Authorization"] = f"Bearer {api_key}"
-
-    payload = {
-        "model": model,
-        "messages": [
-            {"role": "user", "content": prompt}
-        ]
-    }
+        dict: "items" for this page and "next_cursor" (None on the last page).
+    """
+    query = select(model).where(model.campaign_id == campaign_id)
+    if since is not None:
+        query = query.where(time_column >= _db_time(db, since))
+    if before is not None:
+        query = query.where(time_column < _db_time(db, before))
+    if cursor:
+        cursor_time, cursor_id = decode_cursor(cursor)
+        # Compare with the cursor row's stored time itself; the encoded time is the
+        # fallback for a row deleted since
+        anchor = aliased(model)
+        stored_time = select(getattr(anchor, time_column.key)).where(anchor.id == cursor_id).scalar_subquery()
+        query = query.where(tuple_(time_column, model.id)
+                            < tuple_(func.coalesce(stored_time, _as_stored(db, cursor_time)), cursor_id))
+
+    # Fetch one extra row to learn whether another page follows
+    query = query.order_by(time_column.desc(), model.id.desc()).limit(limit + 1)
+    result = await db.execute(query)
+    items = result.scalars().all()
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, time_column.key), last.id)
+    return {"items": items, "next_cursor": next_cursor}
+
+def collection_name(campaign_id: Optional[int] = None) -> str:
+    """
+    Return the ChromaDB collection name for a campaign, or the shared core rules
+    collection when campaign_id is None.
+    """
+    return CORE_COLLECTION if campaign_id is None else f"campaign_{campaign_id}"
+
+def get_sourcebook_collection(campaign_id: Optional[int] = None):
+    """
+    Return the ChromaDB collection that holds sourcebook chunks for a campaign, or
+    the shared core rules collection when campaign_id is None.
+    """
+    return get_chroma_client().get_or_create_collection(name=collection_name(campaign_id))
 
-    print(f"Querying Ollama API at {url} with payload: {payload}")  # Debugging: Log the URL and payload
+def sourcebook_labels(filename: str, book: str = None, doc_type: str = None) -> dict:
+    """
+    Return the filterable labels stored with every chunk of a file.
 
-    try:
-        with httpx.Client() as client:
-            with client.stream("POST", url, json=payload, headers=headers) as response:
-                response.raise_for_status()
-                combined_response = ""
-                for chunk in response.iter_text():
-                    print(f"Received chunk: {chunk}")  # Debugging: Log each chunk
-                    # Extract the "content" field from each JSON object
-                    try:
-                        chunk_json = json.loads(chunk)
-                        if "message" in chunk_json and "content" in chunk_json["message"]:
-                            combined_response += chunk_json["message"]["content"]
-                    except json.JSONDecodeError:
-                        continue
-                return {"response": combined_response}
-    except httpx.RequestError as e:
-        print(f"Error querying Ollama API: {e}")  # Debugging: Log the error
-        return {"error": str(e)}
-
-def process_and_store_files(path: Union[str, Path]):
+    Args:
+        filename (str): Name of the source file; its stem is the default book name.
+        book (str, optional): The book the file belongs to.
+        doc_type (str, optional): The kind of material, e.g. "rules" or "adventure".
+    """
+    return {"book": book or Path(filename).stem, "type": doc_type or DEFAULT_DOC_TYPE}
+
+def build_where(book: str = None, doc_type: str = None) -> Optional[dict]:
+    """
+    Build a ChromaDB where clause from optional book and type filters.
+    """
+    conditions = []
+    if book:
+        conditions.append({"book": book})
+    if doc_type:
+        conditions.append({"type": doc_type})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+def get_manifest(collection) -> IndexManifest:
+    """
+    Return the (cached) index manifest for a ChromaDB collection.
+    """
+    manifest = _manifests.get(collection.name)
+    if manifest is not None:
+        return manifest
+    with _index_lock:
+        if collection.name not in _manifests:
+            _manifests[collection.name] = IndexManifest(collection.name)
+        return _manifests[collection.name]
+
+def get_lexical_index(collection) -> LexicalIndex:
+    """
+    Return the (cached) BM25 index for a ChromaDB collection, rebuilding it from the
+    collection's documents if it is missing.
+    """
+    index = _lexical_indexes.get(collection.name)
+    if index is not None:
+        return index
+    with _index_lock:
+        if collection.name not in _lexical_indexes:
+            index = LexicalIndex(collection.name)
+            if not len(index) and collection.count():
+                rebuild_lexical_index(collection, index)
+            _lexical_indexes[collection.name] = index
+        return _lexical_indexes[collection.name]
+
+def rebuild_lexical_index(collection, index: LexicalIndex = None, batch_size: int = 1000) -> LexicalIndex:
+    """
+    Re-index every document of a ChromaDB collection into its BM25 index.
+    """
+    if index is None:
+        index = LexicalIndex(collection.name)
+    offset = 0
+    while True:
+        batch = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+        index.add(batch["ids"], batch["documents"], batch["metadatas"])
+        offset += len(batch["ids"])
+    index.save()
+    _lexical_indexes[collection.name] = index
+    return index
+
+def store_chunks(collection, filename: str, chunks: list, ids: list, labels: dict = None) -> int:
+    """
+    Write chunks of one file to a ChromaDB collection.
+
+    Args:
+        collection: The ChromaDB collection to write to.
+        filename (str): Name of the source file, stored in the chunk metadata.
+        chunks (list): Chunks produced by chunk_pages.
+        ids (list): One content-derived id per chunk (see manifest.chunk_id).
+        labels (dict, optional): File-level labels stored with every chunk.
+
+    Returns:
+        int: The number of chunks written.
+    """
+    if not chunks:
+        return 0
+    documents = [chunk["text"] for chunk in chunks]
+    metadatas = [chunk_metadata(filename, chunk, labels) for chunk in chunks]
+    # Upsert keeps re-runs idempotent since ids are derived from content; vectors come
+    # from the embedding cache so text embedded before is never embedded again
+    embeddings = embed_chunks(documents)
+    with span("chroma_write"):
+        collection.upsert(documents=documents, embeddings=embeddings, metadatas=metadatas, ids=ids)
+    # The BM25 index is saved by the caller once the whole file is written
+    get_lexical_index(collection).add(ids, documents, metadatas)
+    invalidate_collection(collection.name)
+    return len(chunks)
+
+def _chunks_present(collection, entry: dict) -> bool:
+    # Guards against a manifest that outlived its collection
+    ids = entry["chunk_ids"]
+    return not ids or bool(collection.get(ids=ids[:1], include=[])["ids"])
+
+def check_indexed(collection, source: str, file_hash: str) -> Optional[str]:
+    """
+    Decide whether a file can be skipped because its content is already indexed.
+
+    Args:
+        collection: The ChromaDB collection.
+        source (str): The file's resolved path, used as its manifest key.
+        file_hash (str): The SHA-256 of the file's content.
+
+    Returns:
+        Optional[str]: "unchanged" if this source is indexed with the same content,
+        "duplicate" if another source that still exists has identical content,
+        otherwise None.
+    """
+    manifest = get_manifest(collection)
+    entry = manifest.get(source)
+    if entry and entry["file_hash"] == file_hash and _chunks_present(collection, entry):
+        return "unchanged"
+    # A matching source that is gone from disk was renamed or moved, not copied
+    for other in manifest.find_all_by_hash(file_hash, exclude=source):
+        if Path(other).exists() and _chunks_present(collection, manifest.get(other)):
+            return "duplicate"
+    return None
+
+def find_moved_source(collection, source: str, file_hash: str) -> Optional[str]:
+    """
+    Return the indexed source a file was renamed or moved from: one with the same
+    content hash that no longer exists on disk.
+    """
+    manifest = get_manifest(collection)
+    for other in manifest.find_all_by_hash(file_hash, exclude=source):
+        if not Path(other).exists() and _chunks_present(collection, manifest.get(other)):
+            return other
+    return None
+
+def move_indexed_file(collection, old_source: str, new_source: str, filename: str, file_hash: str,
+                      labels: dict = None, batch_size: int = EMBED_BATCH_SIZE, save: bool = True) -> int:
+    """
+    Re-key a renamed or moved file's chunks to its new path without re-embedding.
+
+    Chunk ids are derived from the source, so each chunk is copied to its new id
+    with its stored embedding and new filename and labels, and the old ids are
+    deleted from ChromaDB and the BM25 index. Pass save=False when moving many
+    files and save the BM25 index once at the end.
+
+    Returns:
+        int: The number of chunks moved.
+    """
+    manifest = get_manifest(collection)
+    if manifest.get(new_source):
+        # The new path held other content before; its chunks are superseded
+        remove_indexed_file(collection, new_source, save=False)
+    old_ids = manifest.get(old_source)["chunk_ids"]
+    lexical_index = get_lexical_index(collection)
+    new_ids = []
+    for start in range(0, len(old_ids), batch_size):
+        found = collection.get(ids=old_ids[start:start + batch_size],
+                               include=["documents", "metadatas", "embeddings"])
+        ids, metadatas = [], []
+        for document, metadata in zip(found["documents"], found["metadatas"]):
+            chunk = {"page": metadata.get("page"), "section": metadata["section"],
+                     "chunk_index": metadata["chunk_index"], "text": document}
+            ids.append(chunk_id(new_source, chunk))
+            metadatas.append(chunk_metadata(filename, chunk, labels))
+        if ids:
+            with span("chroma_write"):
+                collection.upsert(ids=ids, documents=found["documents"], embeddings=found["embeddings"],
+                                  metadatas=metadatas)
+            lexical_index.add(ids, found["documents"], metadatas)
+        new_ids.extend(ids)
+    collection.delete(ids=old_ids)
+    lexical_index.remove(old_ids)
+    if save:
+        lexical_index.save()
+    manifest.set(new_source, file_hash, new_ids)
+    manifest.remove(old_source)
+    invalidate_collection(collection.name)
+    return len(new_ids)
+
+def index_chunks(collection, source: str, filename: str, file_hash: str, chunks: Iterable[dict],
+                 labels: dict = None, batch_size: int = EMBED_BATCH_SIZE,
+                 on_progress: Callable[[int], None] = None, save: bool = True) -> dict:
+    """
+    Bring a file's chunks in ChromaDB up to date, embedding only chunks that changed.
+
+    Chunks are consumed in batches as they arrive, so a lazily extracted file is
+    never held in memory whole; only the chunk ids are kept until the end, when
+    chunks the file no longer contains are deleted.
+
+    Args:
+        collection: The ChromaDB collection.
+        source (str): The file's resolved path, used as its manifest key.
+        filename (str): Name of the source file, stored in the chunk metadata.
+        file_hash (str): The SHA-256 of the file's content.
+        chunks (Iterable[dict]): The file's current chunks, e.g. from iter_file_chunks.
+        labels (dict, optional): File-level labels stored with every chunk.
+        batch_size (int): Chunks embedded and written per ChromaDB call.
+        on_progress (Callable[[int], None], optional): Called with the number of
+            chunks handled after each batch.
+        save (bool): Write the BM25 index to disk afterwards. Bulk ingestion passes
+            False and saves once at the end, since each save rewrites the whole index.
+
+    Returns:
+        dict: Counts of "added", "kept" and "removed" chunks.
+    """
+    manifest = get_manifest(collection)
+    entry = manifest.get(source)
+    old_ids = set(entry["chunk_ids"]) if entry else set()
+    lexical_index = get_lexical_index(collection)
+
+    chunk_ids, seen = [], set()
+    added = kept = 0
+    for batch in iter_batches(chunks, batch_size):
+        batch_by_id = {}
+        for chunk in batch:
+            id_ = chunk_id(source, chunk)
+            if id_ not in seen:
+                seen.add(id_)
+                chunk_ids.append(id_)
+                batch_by_id[id_] = chunk
+
+        candidate_ids = [id_ for id_ in batch_by_id if id_ in old_ids]
+        kept_ids = collection.get(ids=candidate_ids, include=[])["ids"] if candidate_ids else []
+        if kept_ids:
+            # Unchanged chunks may have moved, so refresh metadata without re-embedding
+            kept_metadatas = [chunk_metadata(filename, batch_by_id[id_], labels) for id_ in kept_ids]
+            collection.update(ids=kept_ids, metadatas=kept_metadatas)
+            lexical_index.update_labels(kept_ids, kept_metadatas)
+        kept_set = set(kept_ids)
+        new_ids = [id_ for id_ in batch_by_id if id_ not in kept_set]
+        store_chunks(collection, filename, [batch_by_id[id_] for id_ in new_ids], new_ids, labels)
+        added += len(new_ids)
+        kept += len(kept_ids)
+        if on_progress:
+            on_progress(len(batch_by_id))
+
+    stale_ids = list(old_ids - seen)
+    if stale_ids:
+        collection.delete(ids=stale_ids)
+        lexical_index.remove(stale_ids)
+        invalidate_collection(collection.name)
+
+    if save:
+        lexical_index.save()
+    manifest.set(source, file_hash, chunk_ids)
+    return {"added": added, "kept": kept, "removed": len(stale_ids)}
+
+def remove_indexed_file(collection, source: str, save: bool = True) -> int:
+    """
+    Delete a file's chunks from ChromaDB and forget it in the manifest.
+
+    Pass save=False when removing many files and save the BM25 index once at the end.
+
+    Returns:
+        int: The number of chunks removed.
+    """
+    chunk_ids = get_manifest(collection).remove(source)
+    if chunk_ids:
+        collection.delete(ids=chunk_ids)
+        lexical_index = get_lexical_index(collection)
+        lexical_index.remove(chunk_ids)
+        if save:
+            lexical_index.save()
+        invalidate_collection(collection.name)
+    return len(chunk_ids)
+
+def process_and_store_files(path: Union[str, Path], campaign_id: Optional[int] = None,
+                            book: str = None, doc_type: str = None):
     """
     Process a single file or all files in a directory and store their content in ChromaDB.
 
+    Each file is split into page-aware chunks so retrieval returns passages rather
+    than whole books. Files whose content hash matches the index manifest are
+    skipped, changed files only re-embed the chunks that changed, renamed files
+    keep their chunks under the new path, and when a directory is given, indexed
+    files that were removed from it are pruned.
+
     Args:
         path (Union[str, Path]): Path to a file or directory.
+        campaign_id (Optional[int]): Campaign whose collection receives the files;
+            None stores them in the shared core rules collection.
+        book (str, optional): Book label for every file; defaults to the file name.
+        doc_type (str, optional): Type label for every file, e.g. "rules".
 
     Returns:
-        dict: A summary of processed files.
+        dict: A summary of processed, skipped and removed files.
     """
     path = Path(path)
     if not path.exists():
         return {"error": f"Path '{path}' does not exist."}
 
     # Initialize ChromaDB collection
-    collection = chroma_client.get_or_create_collection(name="dnd_sourcebooks")
+    collection = get_sourcebook_collection(campaign_id)
 
     processed_files = []
+    skipped_files = []
+    removed_files = []
 
     # Process a single file or all files in a directory
     files = [path] if path.is_file() else path.glob("*.*")
+    seen_sources = set()
 
-    for file in files:
-        extracted_text = ""
-        if file.suffix.lower() == ".pdf":
-            with open(file, "rb") as pdf_file:
-                reader = PyPDF2.PdfReader(pdf_file)
-                for page in reader.pages:
-                    extracted_text += page.extract_text()
-        elif file.suffix.lower() == ".docx":
-            doc = docx.Document(file)
-            for paragraph in doc.paragraphs:
-                extracted_text += paragraph.text + "\n"
-        elif file.suffix.lower() == ".txt":
-            with open(file, "r", encoding="utf-8") as txt_file:
-                extracted_text = txt_file.read()
-        else:
-            continue  # Skip unsupported file types
-
-        # Generate a unique ID for the document
-        document_id = str(uuid.uuid4())
-
-        # Store extracted text in ChromaDB
-        if extracted_text.strip():
-            collection.add(documents=[extracted_text], metadatas=[{"filename": file.name}], ids=[document_id])
-            processed_files.append(file.name)
-
-    return {"processed_files": processed_files}
+    # The BM25 index is saved once for the whole run rather than after every file
+    try:
+        for file in files:
+            if file.suffix.lower() not in SUPPORTED_EXTENSIONS:
+                continue  # Skip unsupported file types
+
+            source = str(file.resolve())
+            seen_sources.add(source)
+            file_hash = hash_file(file)
+            if check_indexed(collection, source, file_hash):
+                skipped_files.append(file.name)
+                continue
+
+            # A renamed file keeps its chunks and embeddings under the new path
+            moved_from = find_moved_source(collection, source, file_hash)
+            if moved_from:
+                move_indexed_file(collection, moved_from, source, file.name, file_hash,
+                                  sourcebook_labels(file.name, book, doc_type), save=False)
+                processed_files.append(file.name)
+                continue
+
+            # Stream the file's chunks into ChromaDB a batch at a time
+            counts = index_chunks(collection, source, file.name, file_hash, iter_file_chunks(file),
+                                  sourcebook_labels(file.name, book, doc_type), save=False)
+            if counts["added"] or counts["kept"]:
+                processed_files.append(file.name)
+
+        # Prune files that disappeared from the directory
+        if path.is_dir():
+            for source in get_manifest(collection).sources_under(path):
+                if source not in seen_sources:
+                    remove_indexed_file(collection, source, save=False)
+                    removed_files.append(Path(source).name)
+    finally:
+        get_lexical_index(collection).save()
+
+    return {"processed_files": processed_files, "skipped_files": skipped_files, "removed_files": removed_files}
 
 def debug_process_and_store_files(path: Union[str, Path]):
     """
@@ -175,51 +661,293 @@ def debug_process_and_store_files(path: Union[str, Path]):
         return
 
     # Initialize ChromaDB collection
-    collection = chroma_client.get_or_create_collection(name="dnd_sourcebooks")
+    collection = get_sourcebook_collection()
 
     files = [path] if path.is_file() else path.glob("*.*")
 
     for file in files:
-        extracted_text = ""
-        if file.suffix.lower() == ".pdf":
-            with open(file, "rb") as pdf_file:
-                reader = PyPDF2.PdfReader(pdf_file)
-                for page in reader.pages:
-                    extracted_text += page.extract_text()
-        elif file.suffix.lower() == ".docx":
-            doc = docx.Document(file)
-            for paragraph in doc.paragraphs:
-                extracted_text += paragraph.text + "\n"
-        elif file.suffix.lower() == ".txt":
-            with open(file, "r", encoding="utf-8") as txt_file:
-                extracted_text = txt_file.read()
-
-        print(f"Extracted text from {file.name}:")
-        print(extracted_text[:500])  # Print the first 500 characters for inspection
-
-        # Generate a unique ID for the document
-        document_id = str(uuid.uuid4())
-
-        # Attempt to store extracted text in ChromaDB
+        chunks = extract_chunks(file)
+
+        print(f"Extracted {len(chunks)} chunks from {file.name}:")
+        for chunk in chunks[:3]:
+            print(f"Page {chunk['page']}, section '{chunk['section']}':")
+            print(chunk["text"][:500])  # Print the first 500 characters for inspection
+
+        # Attempt to store the chunks in ChromaDB
         try:
-            if extracted_text.strip():
-                collection.add(documents=[extracted_text], metadatas=[{"filename": file.name}], ids=[document_id])
-                print(f"Successfully added {file.name} to ChromaDB with ID {document_id}.")
+            if chunks:
+                source = str(file.resolve())
+                store_chunks(collection, file.name, chunks, [chunk_id(source, chunk) for chunk in chunks],
+                             sourcebook_labels(file.name))
+                get_lexical_index(collection).save()
+                print(f"Successfully added {len(chunks)} chunks of {file.name} to ChromaDB.")
             else:
                 print(f"No text extracted from {file.name}, skipping.")
         except Exception as e:
             print(f"Error adding {file.name} to ChromaDB: {e}")
 
-def retrieve_from_chromadb(query: str):
+def _vector_hits_many(collections: list, query_embeddings: list, where: Optional[dict], n_results: int,
+                      include_embeddings: bool) -> list:
+    # Per query: (distance, id, document, metadata, embedding) across collections, closest first.
+    # Each collection is searched once for all the queries.
+    include = ["documents", "metadatas", "distances"] + (["embeddings"] if include_embeddings else [])
+    hits = [[] for _ in query_embeddings]
+    for collection in collections:
+        with span("chroma_query"):
+            results = collection.query(query_embeddings=query_embeddings, n_results=n_results,
+                                       where=where, include=include)
+        for index, query_hits in enumerate(hits):
+            ids = results["ids"][index]
+            embeddings = results["embeddings"][index] if include_embeddings else [None] * len(ids)
+            query_hits.extend(zip(results["distances"][index], ids,
+                                  results["documents"][index], results["metadatas"][index], embeddings))
+    for query_hits in hits:
+        query_hits.sort(key=lambda hit: hit[0])
+    return [query_hits[:n_results] for query_hits in hits]
+
+def _vector_hits(collections: list, query: str, where: Optional[dict], n_results: int,
+                 include_embeddings: bool) -> list:
+    # Embed the query once for every collection, with the model the chunks were embedded with
+    return _vector_hits_many(collections, embed_texts([query]), where, n_results, include_embeddings)[0]
+
+def _lexical_hits(collections: list, query: str, book: str, doc_type: str, n_results: int) -> list:
+    # (BM25 score, id, collection) across collections, best first
+    hits = []
+    with span("lexical_search"):
+        for collection in collections:
+            for id_, score in get_lexical_index(collection).search(query, n_results, book, doc_type):
+                hits.append((score, id_, collection))
+    hits.sort(key=lambda hit: hit[0], reverse=True)
+    return hits[:n_results]
+
+def _fetch_chunks(requests: list, include_embeddings: bool) -> dict:
+    # Read chunks back by id from (collection, ids) pairs; a plain get never embeds anything
+    include = ["documents", "metadatas"] + (["embeddings"] if include_embeddings else [])
+    chunks = {}
+    for collection, ids in requests:
+        with span("chroma_query"):
+            found = collection.get(ids=ids, include=include)
+        embeddings = found["embeddings"] if include_embeddings else [None] * len(found["ids"])
+        for id_, document, metadata, embedding in zip(found["ids"], found["documents"],
+                                                      found["metadatas"], embeddings):
+            chunks[id_] = (document, metadata, embedding)
+    return chunks
+
+def retrieve_from_chromadb(query: str, campaign_id: Optional[int] = None, book: str = None,
+                           doc_type: str = None, n_results: int = 5, include_core: bool = True,
+                           include_embeddings: bool = False, mode: str = "vector"):
     """
-    Retrieve content from the ChromaDB collection based on a query.
+    Retrieve content from ChromaDB based on a query.
+
+    Searches the campaign's collection (plus the shared core rules collection unless
+    include_core is False), filtered by book and type labels. In "vector" mode hits
+    are merged by embedding distance; "lexical" mode ranks chunks with the BM25 index
+    alone, which needs no embedding and suits exact names like spells or monsters;
+    "hybrid" mode fuses both rankings with reciprocal rank fusion.
 
     Args:
         query (str): The search query.
+        campaign_id (Optional[int]): Campaign to search; None searches only the core rules.
+        book (str, optional): Only return chunks from this book.
+        doc_type (str, optional): Only return chunks of this type.
+        n_results (int): Maximum number of results.
+        include_core (bool): Also search the shared core rules collection.
+        include_embeddings (bool): Also return each chunk's embedding (for reranking).
+        mode (str): "vector", "hybrid" or "lexical".
+
+    Returns:
+        dict: ChromaDB-style query results (ids, documents, metadatas, distances and,
+        when requested, embeddings). Lexical and hybrid results also carry "scores";
+        chunks found only lexically have a distance of None.
+
+    Raises:
+        ValueError: If mode is not one of RETRIEVAL_MODES.
+    """
+    _check_mode(mode)
+    names = _collection_names(campaign_id, include_core)
+    cache_key = (tuple(names), normalize_query(query), book, doc_type, n_results, include_embeddings, mode)
+    generation = collection_generation(names)
+    cached = retrieval_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    collections = _existing_collections(names)
+    vector = None
+    if mode != "lexical":
+        # Nothing to embed the query for when none of the collections exist yet
+        vector = _vector_hits(collections, query, build_where(book, doc_type),
+                              _vector_candidates(n_results, mode), include_embeddings) if collections else []
+    results = _rank_results(collections, query, book, doc_type, n_results, include_embeddings, mode, vector)
+    # Skipped if an ingest invalidated the collections while this query ran
+    cache_retrieval(cache_key, results, generation)
+    return results
+
+def _check_mode(mode: str):
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode '{mode}'; expected one of {', '.join(RETRIEVAL_MODES)}")
+
+def _collection_names(campaign_id: Optional[int], include_core: bool) -> list:
+    names = [collection_name(campaign_id)]
+    if campaign_id is not None and include_core:
+        names.append(CORE_COLLECTION)
+    return names
+
+def _existing_collections(names: list) -> list:
+    # Reads never create collections, so querying a campaign without sourcebooks
+    # does not leave an empty collection on disk
+    from chromadb.errors import NotFoundError
+    client = get_chroma_client()
+    collections = []
+    for name in names:
+        try:
+            collections.append(client.get_collection(name=name))
+        except NotFoundError:
+            pass
+    return collections
+
+def _vector_candidates(n_results: int, mode: str) -> int:
+    # Vector hits needed for one query; hybrid fuses a deeper candidate list
+    return n_results * HYBRID_CANDIDATE_FACTOR if mode == "hybrid" else n_results
+
+def _rank_results(collections: list, query: str, book: str, doc_type: str, n_results: int,
+                  include_embeddings: bool, mode: str, vector: Optional[list]) -> dict:
+    # Build one query's results from its vector hits (None in lexical mode)
+    if mode == "vector":
+        hits = vector[:n_results]
+        ranked = [(hit[1], hit[0], None) for hit in hits]
+        chunks = {hit[1]: hit[2:] for hit in hits}
+    else:
+        candidates = n_results if mode == "lexical" else n_results * HYBRID_CANDIDATE_FACTOR
+        lexical = _lexical_hits(collections, query, book, doc_type, candidates)
+        if mode == "lexical":
+            ranked = [(id_, None, score) for score, id_, _ in lexical]
+            chunks = {}
+        else:
+            vector = vector[:candidates]
+            distances = {hit[1]: hit[0] for hit in vector}
+            fused = reciprocal_rank_fusion([[hit[1] for hit in vector], [hit[1] for hit in lexical]])
+            ranked = [(id_, distances.get(id_), score) for id_, score in fused[:n_results]]
+            chunks = {hit[1]: hit[2:] for hit in vector}
+        # Read back chunks the vector search did not return
+        wanted = {id_ for id_, _, _ in ranked} - chunks.keys()
+        ids_by_collection = {}
+        for _, id_, collection in lexical:
+            if id_ in wanted:
+                ids_by_collection.setdefault(collection.name, (collection, []))[1].append(id_)
+        chunks.update(_fetch_chunks(list(ids_by_collection.values()), include_embeddings))
+        ranked = [item for item in ranked if item[0] in chunks]
+
+    results = {
+        "ids": [[id_ for id_, _, _ in ranked]],
+        "documents": [[chunks[id_][0] for id_, _, _ in ranked]],
+        "metadatas": [[chunks[id_][1] for id_, _, _ in ranked]],
+        "distances": [[distance for _, distance, _ in ranked]],
+    }
+    if mode != "vector":
+        results["scores"] = [[score for _, _, score in ranked]]
+    if include_embeddings:
+        results["embeddings"] = [[chunks[id_][2] for id_, _, _ in ranked]]
+    return results
+
+def retrieve_batch_from_chromadb(requests: list, campaign_id: Optional[int] = None,
+                                 include_core: bool = True, include_embeddings: bool = False) -> list:
+    """
+    Retrieve content for several queries in one pass.
+
+    Every query that needs vectors is embedded in a single call to the model, and
+    queries sharing the same filters are sent to each collection as one
+    multi-query collection.query, fetching the deepest n_results any of them
+    asks for. Each query is then ranked exactly as retrieve_from_chromadb would,
+    and results already in the retrieval cache are reused.
+
+    Args:
+        requests (list): Dicts with "query" and optionally "n_results" (default 5),
+            "book", "doc_type" and "mode" (default "vector").
+        campaign_id (Optional[int]): Campaign to search; None searches only the core rules.
+        include_core (bool): Also search the shared core rules collection.
+        include_embeddings (bool): Also return each chunk's embedding.
 
     Returns:
-        list: A list of matching documents and their metadata.
+        list: One result dict per request, in order, shaped like retrieve_from_chromadb's.
+
+    Raises:
+        ValueError: If any mode is not one of RETRIEVAL_MODES.
+    """
+    requests = [{"n_results": 5, "book": None, "doc_type": None, "mode": "vector", **request}
+                for request in requests]
+    for request in requests:
+        _check_mode(request["mode"])
+    names = _collection_names(campaign_id, include_core)
+    generation = collection_generation(names)
+
+    results = [None] * len(requests)
+    cache_keys = []
+    pending = []
+    for index, request in enumerate(requests):
+        cache_key = (tuple(names), normalize_query(request["query"]), request["book"], request["doc_type"],
+                     request["n_results"], include_embeddings, request["mode"])
+        cache_keys.append(cache_key)
+        results[index] = retrieval_cache.get(cache_key)
+        if results[index] is None:
+            pending.append(index)
+    if not pending:
+        return results
+
+    collections = _existing_collections(names)
+
+    # One embedding call for every distinct query text that needs vectors
+    vector_indexes = [index for index in pending if requests[index]["mode"] != "lexical"] if collections else []
+    texts = list(dict.fromkeys(requests[index]["query"] for index in vector_indexes))
+    embeddings = dict(zip(texts, embed_texts(texts))) if texts else {}
+
+    # One multi-query search per filter combination
+    groups = {}
+    for index in vector_indexes:
+        where = build_where(requests[index]["book"], requests[index]["doc_type"])
+        groups.setdefault(json.dumps(where, sort_keys=True), (where, []))[1].append(index)
+    vector = {}
+    for where, indexes in groups.values():
+        depth = max(_vector_candidates(requests[index]["n_results"], requests[index]["mode"]) for index in indexes)
+        hits = _vector_hits_many(collections, [embeddings[requests[index]["query"]] for index in indexes],
+                                 where, depth, include_embeddings)
+        vector.update(zip(indexes, hits))
+
+    for index in pending:
+        request = requests[index]
+        results[index] = _rank_results(collections, request["query"], request["book"], request["doc_type"],
+                                       request["n_results"], include_embeddings, request["mode"], vector.get(index, []))
+        cache_retrieval(cache_keys[index], results[index], generation)
+    return results
+
+def warm_start_vector_store() -> dict:
     """
-    collection = chroma_client.get_or_create_collection(name="dnd_sourcebooks")
-    results = collection.query(query_texts=[query], n_results=5)
-    return results
\ No newline at end of file
+    Open the persistent vector store and load everything a first query would need.
+
+    Every existing collection gets its manifest and BM25 index loaded and one
+    query run against it, which pages its vector index into memory; the embedding
+    model is loaded as part of that query. Progress is published in
+    vector_store_status for the readiness endpoint.
+
+    Returns:
+        dict: vector_store_status once warm-up has finished.
+    """
+    started = time.perf_counter()
+    vector_store_status.update(status="warming", error=None)
+    try:
+        client = get_chroma_client()
+        collections = [client.get_or_create_collection(name=CORE_COLLECTION)]
+        collections += [collection for collection in client.list_collections() if collection.name != CORE_COLLECTION]
+        warm_query = embed_texts(["warm start"])
+        for collection in collections:
+            count = collection.count()
+            get_manifest(collection)
+            get_lexical_index(collection)
+            if count:
+                collection.query(query_embeddings=warm_query, n_results=1, include=[])
+            vector_store_status["collections"][collection.name] = count
+        vector_store_status["status"] = "ready"
+    except Exception as e:
+        print(f"Error warming the vector store: {e}")  # Debugging: Log the error
+        vector_store_status.update(status="failed", error=str(e))
+    vector_store_status["seconds"] = round(time.perf_counter() - started, 3)
+    return vector_store_status
@@ -0,0 +1,30 @@
+import os
+import threading
+
+# Directory of the persistent ChromaDB store (the manifests, BM25 indexes and
+# embedding cache live alongside it)
+CHROMA_DIR = os.getenv("CHROMA_DIR", "chroma_data")
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_chroma_client():
+    """
+    Return the process-wide ChromaDB client, opening the persistent store on first use.
+
+    Every module goes through this function, so there is exactly one client per
+    process and the collections written by one ingest survive a restart.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # Imported here: chromadb is slow to import and only needed once retrieval runs
+                import chromadb
+                from chromadb.config import Settings
+                _client = chromadb.PersistentClient(
+                    path=CHROMA_DIR,
+                    settings=Settings(anonymized_telemetry=False)
+                )
+    return _client